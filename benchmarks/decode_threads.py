@@ -0,0 +1,99 @@
+"""
+Benchmark of the record-parallel decode kernel: time BDF(fname, n_threads=n)
+for n = 1 .. number of cores on a synthetic file (or a given *.bdf file), e.g.
+python benchmarks/decode_threads.py
+python benchmarks/decode_threads.py filename.bdf
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from numba import config
+
+from biosemipy.bdf import BDF, _header_bytes
+
+N_CHANS = 73  # including Status channel
+N_RECS = 600  # 10 minutes with 1 s records
+N_SAMPS = 2048
+N_REPEATS = 3
+
+
+def make_file(fname, n_chans=N_CHANS, n_recs=N_RECS, n_samps=N_SAMPS):
+    """
+    Write a synthetic bdf file with random data channels (no triggers).
+    :param fname: string
+    :param n_chans: int (including Status channel)
+    :param n_recs: int
+    :param n_samps: int (samples per record)
+    """
+
+    labels = [f"A{x + 1}" for x in range(n_chans - 1)] + ["Status"]
+    hdr = {
+        "id2": "BIOSEMI",
+        "text1": "",
+        "text2": "",
+        "date": "01.01.25",
+        "time": "00.00.00",
+        "n_bytes_hdr": (n_chans + 1) * 256,
+        "format": "24BIT",
+        "n_recs": n_recs,
+        "dur_recs": 1,
+        "n_chans": n_chans,
+        "labels": labels,
+        "type": [""] * n_chans,
+        "unit": ["uV"] * (n_chans - 1) + ["Boolean"],
+        "pmin": [-262144] * n_chans,
+        "pmax": [262143] * n_chans,
+        "dmin": [-8388608] * n_chans,
+        "dmax": [8388607] * n_chans,
+        "filter": [""] * n_chans,
+        "n_samps": [n_samps] * n_chans,
+        "reserved": [""] * n_chans,
+    }
+
+    rng = np.random.default_rng(0)
+    with open(fname, "wb") as f:
+        f.write(_header_bytes(hdr))
+        status = np.zeros(n_samps * 3, dtype=np.uint8)
+        for _ in range(n_recs):
+            f.write(rng.integers(0, 256, (n_chans - 1) * n_samps * 3, dtype=np.uint8))
+            f.write(status)
+
+
+def benchmark(fname, n_repeats=N_REPEATS):
+    """
+    Print the best of n_repeats read times per number of threads.
+    :param fname: string
+    :param n_repeats: int
+    """
+
+    BDF(fname, n_threads=1)  # compile kernels and warm up the page cache
+    BDF(fname, n_threads=0)
+
+    n_cores = min(os.cpu_count(), config.NUMBA_NUM_THREADS)
+    print(f"{fname}: {os.path.getsize(fname) / 2**20:.0f} MB, {n_cores} cores")
+    t_serial = None
+    for n_threads in range(1, n_cores + 1):
+        times = []
+        for _ in range(n_repeats):
+            tic = time.perf_counter()
+            BDF(fname, n_threads=n_threads)
+            times.append(time.perf_counter() - tic)
+        t_serial = t_serial or min(times)
+        print(
+            f"n_threads={n_threads:<3} {min(times):.3f} s"
+            f"  speedup {t_serial / min(times):.2f}"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        benchmark(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fname = os.path.join(tmp_dir, "benchmark.bdf")
+            make_file(fname)
+            benchmark(fname)
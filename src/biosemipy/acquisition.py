@@ -0,0 +1,348 @@
+"""
+Python module to acquire live BioSemi EEG data from the ActiView TCP server.
+ActiView sends 24-bit little-endian samples, channel interleaved (all
+channels of sample 1, then all channels of sample 2, ...), with the
+trigger/status channel last when enabled. Values are encoded as in the
+Status/data channels of *.bdf files.
+"""
+
+import socket
+import threading
+import time
+
+import numpy as np
+from numba import jit
+
+from biosemipy.bdf import BDF
+
+
+class BufferOverrun(Exception):
+    """Requested samples of a RingBuffer were (partly) overwritten."""
+
+
+class RingBuffer:
+    """
+    Fixed-size preallocated ring buffer (single writer, lock-free readers).
+    The writer advances n_reserved to the end of the samples it is about to
+    write, fills them and then advances n_written. Readers copy the
+    requested samples and check n_reserved afterwards, retrying if the
+    samples were (or are being) overwritten while copying.
+    """
+
+    def __init__(self, n_chans, size, dtype="float32"):
+        """
+        :param n_chans: int (data channels, excluding Status channel)
+        :param size: int (samples)
+        :param dtype: string
+        """
+
+        self.size = size
+        self.data = np.zeros((n_chans, size), dtype=dtype)
+        self.trig = np.zeros(size, dtype=np.int16)
+        self.status = np.zeros(size, dtype=np.int16)
+        self.n_written = 0  # total samples written (never wraps)
+        self.n_reserved = 0  # total samples written or being written
+
+    def read(self, start, stop):
+        """
+        Copy samples start to stop (absolute sample numbers, stop exclusive).
+        Raises BufferOverrun if the samples were overwritten before or
+        while copying.
+        :param start: int
+        :param stop: int
+        :return: data, trig, status
+        """
+
+        assert 0 <= start <= stop <= self.n_written, "Samples not yet written!"
+        idx = np.arange(start, stop) % self.size
+        data, trig, status = self.data[:, idx], self.trig[idx], self.status[idx]
+        if start < self.n_reserved - self.size:
+            raise BufferOverrun("Samples overwritten!")
+
+        return data, trig, status
+
+    def latest(self, n_samps):
+        """
+        Copy the most recent n_samps samples (fewer if not yet available, or
+        if the oldest ones are being overwritten).
+        :param n_samps: int
+        :return: data, trig, status, sample number of first sample
+        """
+
+        while True:
+            n_reserved = self.n_reserved
+            stop = self.n_written
+            start = max(0, stop - n_samps, n_reserved - self.size)
+            try:
+                return *self.read(start, stop), start
+            except BufferOverrun:  # overwritten while copying, try again
+                continue
+
+
+class ActiViewClient:
+    """
+    Client for the ActiView TCP server. A background thread receives fixed
+    size packets and decodes them into a RingBuffer, e.g.
+    client = ActiViewClient("localhost", 8888, n_chans=73, n_samps=64)
+    client.start()
+    data, trig, status, first = client.buffer.latest(2048)
+    client.stop()
+    """
+
+    def __init__(
+        self,
+        host="localhost",
+        port=8888,
+        n_chans=73,
+        n_samps=64,
+        freq=2048,
+        scale=0.03125,
+        buffer_seconds=60,
+        dtype="float32",
+    ):
+        """
+        :param host: string
+        :param port: int
+        :param n_chans: int (including trigger/status channel)
+        :param n_samps: int (samples per channel per packet, "TCP samples/channel")
+        :param freq: int (sampling frequency)
+        :param scale: float/numpy array (µV per bit, default 31.25 nV)
+        :param buffer_seconds: float
+        :param dtype: string
+        """
+
+        self.host = host
+        self.port = port
+        self.n_chans = n_chans
+        self.n_samps = n_samps
+        self.freq = freq
+        self.scale = np.broadcast_to(np.asarray(scale, dtype=np.float64), n_chans)
+        self.buffer = RingBuffer(n_chans - 1, int(buffer_seconds * freq), dtype)
+        self.sock = None
+        self.thread = None
+        self.running = False
+        self.error = None
+        self._metrics = dict(
+            packets=0, bytes=0, decode_time=0.0, decode_max=0.0, t_start=None
+        )
+
+    def start(self):
+        """Connect to the server and start receiving in a background thread."""
+
+        self.sock = socket.create_connection((self.host, self.port))
+        self.running = True
+        self.thread = threading.Thread(target=self._receive, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop receiving and close the connection."""
+
+        self.running = False
+        if self.sock is not None:
+            self.sock.close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def metrics(self):
+        """
+        Throughput and latency of the acquisition.
+        packets/samples/bytes: received so far
+        throughput: samples per second since the first packet
+        decode_mean/decode_max: time to decode a packet into the buffer (s)
+        lag: wall clock time minus stream time of the newest sample (s),
+        growing values indicate the client is falling behind (negative when
+        a replay runs faster than real-time)
+        :return: dict
+        """
+
+        m = self._metrics
+        n_samps = self.buffer.n_written
+        elapsed = 0.0 if m["t_start"] is None else time.perf_counter() - m["t_start"]
+
+        return dict(
+            packets=m["packets"],
+            samples=n_samps,
+            bytes=m["bytes"],
+            throughput=n_samps / elapsed if elapsed > 0 else 0.0,
+            decode_mean=m["decode_time"] / max(m["packets"], 1),
+            decode_max=m["decode_max"],
+            lag=elapsed - n_samps / self.freq,
+        )
+
+    def _receive(self):
+        """Receive and decode packets until stopped or disconnected."""
+
+        n_bytes = self.n_chans * self.n_samps * 3
+        packet = bytearray(n_bytes)
+        view = memoryview(packet)
+        buf = np.frombuffer(packet, dtype=np.uint8)
+        m = self._metrics
+
+        try:
+            while self.running:
+                pos = 0
+                while pos < n_bytes:
+                    n = self.sock.recv_into(view[pos:], n_bytes - pos)
+                    if n == 0:  # server closed connection
+                        return
+                    pos += n
+
+                tic = time.perf_counter()
+                if m["t_start"] is None:
+                    m["t_start"] = tic - self.n_samps / self.freq
+                self.buffer.n_reserved = self.buffer.n_written + self.n_samps
+                _tcp2matrix(
+                    buf,
+                    self.scale,
+                    self.buffer.data,
+                    self.buffer.trig,
+                    self.buffer.status,
+                    self.buffer.n_written % self.buffer.size,
+                    self.n_chans,
+                    self.n_samps,
+                )
+                self.buffer.n_written += self.n_samps
+                toc = time.perf_counter() - tic
+
+                m["packets"] += 1
+                m["bytes"] += n_bytes
+                m["decode_time"] += toc
+                m["decode_max"] = max(m["decode_max"], toc)
+        except OSError as e:
+            if self.running:
+                self.error = e
+        finally:
+            self.running = False
+
+
+class FakeActiViewServer:
+    """
+    Local TCP server replaying a *.bdf file in the ActiView TCP format, at
+    real-time (speed=1), accelerated (speed>1) or maximum (speed=0) rate,
+    for testing ActiViewClient without an acquisition system, e.g.
+    server = FakeActiViewServer("filename.bdf", speed=10)
+    server.start()
+    client = ActiViewClient(port=server.port, **server.client_settings())
+    """
+
+    def __init__(self, fname, host="localhost", port=0, n_samps=64, speed=1.0):
+        """
+        :param fname: string
+        :param host: string
+        :param port: int (default: 0, any free port)
+        :param n_samps: int (samples per channel per packet)
+        :param speed: float
+        """
+
+        self.bdf = BDF(fname, hdr_only=True)
+        self.fname = fname
+        self.n_samps = n_samps
+        self.speed = speed
+        self.sock = socket.create_server((host, port))
+        self.host, self.port = self.sock.getsockname()[:2]
+        self.thread = None
+
+    def client_settings(self):
+        """
+        Keyword arguments for ActiViewClient matching the replayed file.
+        :return: dict
+        """
+
+        return dict(
+            host=self.host,
+            n_chans=self.bdf.hdr["n_chans"],
+            n_samps=self.n_samps,
+            freq=self.bdf.hdr["freq"][0],
+            scale=self.bdf.hdr["scale"],
+        )
+
+    def start(self):
+        """Serve one client in a background thread."""
+
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop serving."""
+
+        self.sock.close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _serve(self):
+        """Send the data records (channel interleaved) to the first client."""
+
+        hdr = self.bdf.hdr
+        n_chans, n_recs = hdr["n_chans"], hdr["n_recs"]
+        n_samps_rec = hdr["n_samps"][0]
+        recs = np.memmap(
+            self.fname,
+            dtype="uint8",
+            mode="r",
+            offset=hdr["n_bytes_hdr"],
+            shape=(n_recs, n_chans, n_samps_rec, 3),
+        )
+        t_packet = self.n_samps / (hdr["freq"][0] * self.speed) if self.speed else 0
+
+        try:
+            conn, _ = self.sock.accept()
+        except OSError:  # stopped before a client connected
+            return
+
+        n_packets = (n_recs * n_samps_rec) // self.n_samps
+        t_start = time.perf_counter()
+        with conn:
+            buf = np.empty((0, n_chans, 3), dtype=np.uint8)
+            rec = 0
+            for packet in range(n_packets):
+                while len(buf) < self.n_samps:  # (samples, channels, bytes)
+                    buf = np.concatenate([buf, recs[rec].transpose(1, 0, 2)])
+                    rec += 1
+
+                # pace packets (t_packet is 0 for maximum rate)
+                delay = t_start + (packet + 1) * t_packet - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+                try:
+                    conn.sendall(buf[: self.n_samps].tobytes())
+                except OSError:  # client disconnected
+                    return
+                buf = buf[self.n_samps :]
+
+
+@jit(nopython=True)
+def _tcp2matrix(buf, scale, data, trig, status, pos, n_chans, n_samps):
+    """
+    Decode a channel interleaved ActiView TCP packet into a ring buffer.
+    :param buf: numpy vector (uint8)
+    :param scale: numpy array
+    :param data: numpy matrix (ring buffer, channels by timepoints)
+    :param trig: numpy vector (ring buffer)
+    :param status: numpy vector (ring buffer)
+    :param pos: int (ring buffer position of first sample)
+    :param n_chans: int
+    :param n_samps: int
+    """
+
+    size = data.shape[1]
+    idx = 0
+    for samp in range(n_samps):
+        col = (pos + samp) % size
+        for chan in range(n_chans):
+            if chan < (n_chans - 1):
+                val1 = np.int32(buf[idx]) << 8
+                val2 = np.int32(buf[idx + 1]) << 16
+                val3 = np.int32(buf[idx + 2]) << 24
+                val = (val1 | val2 | val3) >> 8
+
+                if val >= 2**23:
+                    val -= 2**24
+
+                data[chan, col] = val * scale[chan]
+            else:  # last channel is trigger/status channel
+                val1 = np.int16(buf[idx])
+                val2 = np.int16(buf[idx + 1])
+                trig[col] = val1 | (val2 << 8)
+                status[col] = np.int16(buf[idx + 2])
+            idx += 3
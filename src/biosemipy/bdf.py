@@ -1,9 +1,16 @@
 """
 Python module to read BioSemi EEG data files.
 """
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
 import numpy as np
-from numba import jit
-from scipy.signal import decimate
+from numba import config, get_num_threads, jit, prange, set_num_threads
+
+from biosemipy import filters, resample
 
 
 class BDF:
@@ -11,23 +18,55 @@ class BDF:
     BioSemi Class
     Methods:
         read
+        read_progressive
+        load
+        iter_chunks
         write
         merge
         crop
         decimate
+        resample
+        filter
         delete_channels
         select_channels
         channel_difference
         rereference
+        epochs
     """
 
-    def __init__(self, fname=None, hdr_only=False, chans=None):
+    def __init__(
+        self,
+        fname=None,
+        hdr_only=False,
+        chans=None,
+        lazy=False,
+        start=None,
+        stop=None,
+        units="seconds",
+        n_threads=1,
+        dtype="float64",
+        cache_dir=None,
+        cache_size=None,
+    ):
         """
         Read BioSemi EEG datafile header plus data (default)
         See https://www.biosemi.com/faq_file_format.htm for details
         :param fname: str
         :param hdr_only:  bool (default: True)
         :param chans: list (default: all channels)
+        :param lazy: bool (default: False) memory-map data records and
+        decode only the records touched when indexing data
+        :param start: int/float (default: start of file)
+        :param stop: int/float (default: end of file)
+        :param units: string "seconds" (default), "samples" or "records"
+        :param n_threads: int (default: 1) threads used to decode data
+        records, 0 uses all available cores
+        :param dtype: string "float64" (default), "float32" or "int32"
+        ("int32" stores raw 24-bit counts, see scale_data)
+        :param cache_dir: string (default: None) directory in which decoded
+        data is cached and memory-mapped when the same file is read again
+        :param cache_size: int (default: 8 GiB) cache size in bytes, least
+        recently used entries are removed when exceeded
         """
 
         self.fname = fname
@@ -39,7 +78,19 @@ class BDF:
         self.status = None
 
         if fname is not None:
-            self.read(fname, hdr_only=hdr_only, chans=chans)
+            self.read(
+                fname,
+                hdr_only=hdr_only,
+                chans=chans,
+                lazy=lazy,
+                start=start,
+                stop=stop,
+                units=units,
+                n_threads=n_threads,
+                dtype=dtype,
+                cache_dir=cache_dir,
+                cache_size=cache_size,
+            )
 
     def __str__(self):
         """Print out some useful information."""
@@ -56,62 +107,216 @@ class BDF:
     def __repr__(self):
         return self.__str__()
 
-    def read(self, fname, hdr_only=False, chans=None):
+    def read(
+        self,
+        fname,
+        hdr_only=False,
+        chans=None,
+        lazy=False,
+        start=None,
+        stop=None,
+        units="seconds",
+        n_threads=1,
+        dtype="float64",
+        cache_dir=None,
+        cache_size=None,
+    ):
         """
-        Read bdf file.
+        Read bdf file. Only the data records covering start to stop are
+        read from disk (start inclusive, stop exclusive, both zero based).
+        The returned data/trig/time are relative to the first record read.
         :param fname: string
         :param hdr_only: bool
         :param chans: list
+        :param lazy: bool
+        :param start: int/float
+        :param stop: int/float
+        :param units: string "seconds", "samples" or "records"
+        :param n_threads: int
+        :param dtype: string "float64", "float32" or "int32" (raw counts)
+        :param cache_dir: string (not used when lazy)
+        :param cache_size: int
         :return:
         """
 
         with open(fname, "rb") as f:
-            self.hdr["id1"] = f.read(1)
-            self.hdr["id2"] = f.read(7).decode()
-            self.hdr["text1"] = f.read(80).decode()
-            self.hdr["text2"] = f.read(80).decode()
-            self.hdr["date"] = f.read(8).decode()
-            self.hdr["time"] = f.read(8).decode()
-            self.hdr["n_bytes_hdr"] = int(f.read(8))
-            self.hdr["format"] = f.read(44).decode().strip()
-            self.hdr["n_recs"] = int(f.read(8))
-            self.hdr["dur_recs"] = int(f.read(8))
-            self.hdr["n_chans"] = int(f.read(4))
-            ch = range(self.hdr["n_chans"])
-            self.hdr["labels"] = [f.read(16).decode().strip() for _ in ch]
-            self.hdr["type"] = [f.read(80).decode().strip() for _ in ch]
-            self.hdr["unit"] = [f.read(8).decode().strip() for _ in ch]
-            self.hdr["pmin"] = np.array([int(f.read(8)) for _ in ch])
-            self.hdr["pmax"] = np.array([int(f.read(8)) for _ in ch])
-            self.hdr["dmin"] = np.array([int(f.read(8)) for _ in ch])
-            self.hdr["dmax"] = np.array([int(f.read(8)) for _ in ch])
-            self.hdr["filter"] = [f.read(80).decode().strip() for _ in ch]
-            self.hdr["n_samps"] = [int(f.read(8)) for _ in ch]
-            self.hdr["reserved"] = [f.read(32).decode().strip() for _ in ch]
-            self.hdr["scale"] = np.array(
-                (self.hdr["pmax"] - self.hdr["pmin"])
-                / (self.hdr["dmax"] - self.hdr["dmin"])
-            )
-            self.hdr["freq"] = [
-                int(self.hdr["n_samps"][i] / self.hdr["dur_recs"]) for i in ch
-            ]
+            self._read_header(f)
 
             if hdr_only:
                 return
 
+            assert np.dtype(dtype) in _DTYPES, "dtype not recognized"
+
             if chans:  # specific selection made
                 chans = self._channel_idx(chans)
             else:  # read all channels
                 chans = list(range(self.hdr["n_chans"]))
 
-            bdf_dat = np.fromfile(f, dtype="uint8")
+            rec_start, rec_stop = self._record_range(start, stop, units)
+            n_bytes_rec = self.hdr["n_chans"] * self.hdr["n_samps"][0] * 3
+            offset = self.hdr["n_bytes_hdr"] + rec_start * n_bytes_rec
+            self.hdr["n_recs"] = rec_stop - rec_start
+
+            cached = None
+            if cache_dir is not None and not lazy:
+                fname_cache = _cache_fname(
+                    cache_dir, fname, chans, rec_start, rec_stop, dtype
+                )
+                cached = _cache_load(fname_cache)
+
+            if cached is not None:
+                self.data, trig, self.status = cached
+                self.trig = {"raw": trig}
+            elif lazy:
+                self._memmap(fname, chans, offset, n_threads, dtype)
+            elif len(chans) < self.hdr["n_chans"]:
+                # gather only the selected channel bytes from each record
+                data = self._lazy_data(fname, chans, offset, n_threads, dtype)
+                self.data, trig, self.status = data.decode(0, data.n_recs, data.chans)
+                self.trig = {"raw": trig}
+            else:
+                f.seek(offset)
+                bdf_dat = np.fromfile(
+                    f, dtype="uint8", count=self.hdr["n_recs"] * n_bytes_rec
+                )
+                self._bdf2matrix(bdf_dat, chans, n_threads, dtype)
+
+            if cache_dir is not None and not lazy and cached is None:
+                _cache_store(
+                    fname_cache, self.data, self.trig["raw"], self.status, cache_size
+                )
 
-            self._bdf2matrix(bdf_dat, chans)
             self.freq = self.hdr["freq"][0]
             self._trigger_info()
             self.time = np.arange(0, np.size(self.data, 1)) / self.freq
             self._update_header(chans)
 
+    def _read_header(self, f):
+        """
+        Read header with one read for the fixed and one for the channel
+        fields, which are parsed as fixed-width numpy string arrays.
+        :param f: file object
+        """
+
+        buf = f.read(256)
+        self.hdr["id1"] = buf[0:1]
+        self.hdr["id2"] = buf[1:8].decode()
+        self.hdr["text1"] = buf[8:88].decode()
+        self.hdr["text2"] = buf[88:168].decode()
+        self.hdr["date"] = buf[168:176].decode()
+        self.hdr["time"] = buf[176:184].decode()
+        self.hdr["n_bytes_hdr"] = int(buf[184:192])
+        self.hdr["format"] = buf[192:236].decode().strip()
+        self.hdr["n_recs"] = int(buf[236:244])
+        self.hdr["dur_recs"] = int(buf[244:252])
+        self.hdr["n_chans"] = int(buf[252:256])
+
+        n_chans = self.hdr["n_chans"]
+        buf = f.read(256 * n_chans)
+        pos = 0
+        for field, width in _HDR_CHAN_FIELDS:
+            vals = np.frombuffer(buf, dtype=f"S{width}", count=n_chans, offset=pos)
+            if field in ["pmin", "pmax", "dmin", "dmax"]:
+                self.hdr[field] = vals.astype(np.int64)
+            elif field == "n_samps":
+                self.hdr[field] = vals.astype(np.int64).tolist()
+            else:
+                self.hdr[field] = [x.decode().strip() for x in vals.tolist()]
+            pos += width * n_chans
+
+        self.hdr["scale"] = np.array(
+            (self.hdr["pmax"] - self.hdr["pmin"])
+            / (self.hdr["dmax"] - self.hdr["dmin"])
+        )
+        self.hdr["freq"] = [int(x / self.hdr["dur_recs"]) for x in self.hdr["n_samps"]]
+
+    def iter_chunks(self, n_records=1, chans=None, n_threads=1, dtype="float64"):
+        """
+        Iterate over the data records of the file, decoding n_records at a
+        time so that memory is bounded by the chunk size, e.g.
+        for data, trig, status, offset in BDF(fname, hdr_only=True).iter_chunks(60):
+        :param n_records: int
+        :param chans: list (default: all channels)
+        :param n_threads: int
+        :param dtype: string "float64", "float32" or "int32" (raw counts)
+        :return: generator of (data, trig, status, sample_offset)
+        """
+
+        assert n_records > 0, "n_records should be > 0"
+        assert np.dtype(dtype) in _DTYPES, "dtype not recognized"
+
+        bdf = BDF(self.fname, hdr_only=True)  # header of file on disk
+        if chans:
+            chans = bdf._channel_idx(chans)
+        else:
+            chans = list(range(bdf.hdr["n_chans"]))
+        data = bdf._lazy_data(
+            self.fname, chans, bdf.hdr["n_bytes_hdr"], n_threads, dtype
+        )
+
+        for rec_start in range(0, data.n_recs, n_records):
+            rec_stop = min(rec_start + n_records, data.n_recs)
+            chunk, trig, status = data.decode(rec_start, rec_stop, data.chans)
+            yield chunk, trig, status, rec_start * data.n_samps
+
+    def read_progressive(
+        self, fname, chans=None, n_records=60, n_threads=1, dtype="float64"
+    ):
+        """
+        Read bdf file n_records at a time, e.g. to display the data while
+        it is read. data, trig["raw"] and status are allocated for the
+        whole file and filled in place, yielding the number of samples
+        read after each step. If iteration is stopped early (cancelled),
+        data/trig/status/time are truncated to the records read. Trigger
+        information is updated when the generator is exhausted or closed.
+        :param fname: string
+        :param chans: list (default: all channels)
+        :param n_records: int
+        :param n_threads: int
+        :param dtype: string "float64", "float32" or "int32" (raw counts)
+        :return: generator of (samples read, total samples)
+        """
+
+        assert n_records > 0, "n_records should be > 0"
+        assert np.dtype(dtype) in _DTYPES, "dtype not recognized"
+
+        self.read(fname, hdr_only=True)
+        self.fname = fname
+        if chans:
+            chans = self._channel_idx(chans)
+        else:
+            chans = list(range(self.hdr["n_chans"]))
+        data = self._lazy_data(fname, chans, self.hdr["n_bytes_hdr"], n_threads, dtype)
+
+        n_pnts = data.n_recs * data.n_samps
+        self.data = np.zeros((len(data.chans), n_pnts), dtype=dtype)
+        self.trig = {"raw": np.zeros(n_pnts, dtype=np.int16)}
+        self.status = np.zeros(n_pnts, dtype=np.int16)
+        self.freq = self.hdr["freq"][0]
+        self.time = np.arange(0, n_pnts) / self.freq
+        self._update_header(chans)
+        self._trigger_info()
+
+        rec_stop = 0
+        try:
+            for rec_start in range(0, data.n_recs, n_records):
+                rec_stop = min(rec_start + n_records, data.n_recs)
+                chunk, trig, status = data.decode(rec_start, rec_stop, data.chans)
+                samps = slice(rec_start * data.n_samps, rec_stop * data.n_samps)
+                self.data[:, samps] = chunk
+                self.trig["raw"][samps] = trig
+                self.status[samps] = status
+                yield samps.stop, n_pnts
+        finally:
+            if rec_stop < data.n_recs:  # cancelled
+                n_read = rec_stop * data.n_samps
+                self.data = self.data[:, :n_read]
+                self.trig["raw"] = self.trig["raw"][:n_read]
+                self.status = self.status[:n_read]
+                self.time = self.time[:n_read]
+                self.hdr["n_recs"] = rec_stop
+            self._trigger_info()
+
     def write(self, fname=None):
         """
         Write bdf file.
@@ -122,41 +327,17 @@ class BDF:
             fname = self.fname
         print(f"Writing to file {fname}")
 
-        hdr = [0xFF]
-        [hdr.append(ord(i)) for i in self.hdr["id2"]]
-        [hdr.append(ord(i)) for i in self.hdr["text1"]]
-        [hdr.append(ord(i)) for i in self.hdr["text2"]]
-        [hdr.append(ord(i)) for i in self.hdr["date"]]
-        [hdr.append(ord(i)) for i in self.hdr["time"]]
-        [hdr.append(ord(i)) for i in "{0:<8}".format(self.hdr["n_bytes_hdr"])]
-        [hdr.append(ord(i)) for i in "{0:<44}".format(self.hdr["format"])]
-        [hdr.append(ord(i)) for i in "{0:<8}".format(self.hdr["n_recs"])]
-        [hdr.append(ord(i)) for i in "{0:<8}".format(self.hdr["dur_recs"])]
-        [hdr.append(ord(i)) for i in "{0:<4}".format(self.hdr["n_chans"])]
-        [hdr.append(ord(j)) for i in self.hdr["labels"] for j in "{0:<16}".format(i)]
-        [hdr.append(ord(j)) for i in self.hdr["type"] for j in "{0:<80}".format(i)]
-        [hdr.append(ord(j)) for i in self.hdr["unit"] for j in "{0:<8}".format(i)]
-        [hdr.append(ord(j)) for i in self.hdr["pmin"] for j in "{0:<8}".format(i)]
-        [hdr.append(ord(j)) for i in self.hdr["pmax"] for j in "{0:<8}".format(i)]
-        [hdr.append(ord(j)) for i in self.hdr["dmin"] for j in "{0:<8}".format(i)]
-        [hdr.append(ord(j)) for i in self.hdr["dmax"] for j in "{0:<8}".format(i)]
-        [hdr.append(ord(j)) for i in self.hdr["filter"] for j in "{0:<80}".format(i)]
-        [hdr.append(ord(j)) for i in self.hdr["n_samps"] for j in "{0:<8}".format(i)]
-        [hdr.append(ord(j)) for i in self.hdr["reserved"] for j in "{0:<32}".format(i)]
-
-        sf = np.array(self.hdr["scale"][:-1])
-        data = np.int32(np.round(self.data / sf[:, None]))
-        bdf = _matrix2bdf(
-            data,
-            self.trig["raw"],
-            self.status,
-            self.hdr["n_recs"],
-            self.hdr["n_samps"][0],
-            self.hdr["n_chans"],
-        )
+        n_samps = self.hdr["n_samps"][0]
+        n_pnts = self.hdr["n_recs"] * n_samps
+        step = _WRITE_N_RECS * n_samps
 
-        dat = np.concatenate([hdr, bdf])
-        dat.astype("uint8").tofile(fname)
+        with BDFWriter(fname, self.hdr) as writer:
+            for idx in range(0, n_pnts, step):
+                writer.write_records(
+                    self.data[:, idx : idx + step],
+                    self.trig["raw"][idx : idx + step],
+                    self.status[idx : idx + step],
+                )
 
     def merge(self, fname, *args):
         """
@@ -172,6 +353,7 @@ class BDF:
             assert self.hdr["n_chans"] == x.hdr["n_chans"], "Diff number of channels!"
             assert self.hdr["labels"] == x.hdr["labels"], "Diff channel labels!"
             assert self.hdr["freq"][0] == x.hdr["freq"][0], "Diff sample rate!"
+            assert self.data.dtype == x.data.dtype, "Diff data dtype!"
 
         self.fname = fname
         for x in data_to_merge:
@@ -241,25 +423,62 @@ class BDF:
 
     def decimate(self, factor):
         """
-        Downsample bdf file by a factor of 2, 4, 8, or 16 using
-        scipy.signal.decimate.
+        Downsample bdf file by an integer factor (see resample).
+        :param factor: int
+        """
+
+        assert int(factor) == factor and factor >= 1, "factor should be an integer"
+        self.resample(self.freq / factor)
+
+    def resample(self, freq, max_factor=10):
+        """
+        Resample bdf file to freq using polyphase FIR filtering (integer
+        factors in several stages, see biosemipy.resample). Trigger onsets
+        are mapped to the nearest new sample and the status channel is taken
+        from the nearest sample. The number of samples per record must
+        remain an integer.
+        :param freq: int
+        :param max_factor: int (maximum factor per stage)
         """
 
-        assert factor in [1, 2, 4, 8, 16]
-        self.data = decimate(self.data, factor)
+        up, down = resample.ratio(self.freq, freq)
+        n_samps = [x * up / down for x in self.hdr["n_samps"]]
+        assert all(int(x) == x for x in n_samps), "n_samps per record not integer"
+
+        self.scale_data()
+        n_pnts = np.shape(self.data)[1]
+        self.data = resample.resample(np.asarray(self.data), up, down, max_factor)
+        n_pnts_new = np.shape(self.data)[1]
 
         # adjust header
-        self.hdr["freq"] = [int(x / factor) for x in self.hdr["freq"]]
-        self.hdr["n_samps"] = [int(x / factor) for x in self.hdr["n_samps"]]
+        self.hdr["freq"] = [int(x * up / down) for x in self.hdr["freq"]]
+        self.hdr["n_samps"] = [int(x) for x in n_samps]
 
-        # adjusut time vector
-        self.freq = int(self.freq / factor)
-        self.time = np.arange(0, np.shape(self.data)[1] - 1) / self.freq
+        # adjust time vector
+        self.freq = self.hdr["freq"][0]
+        self.time = np.arange(0, n_pnts_new) / self.freq
+
+        # adjust triggers and status
+        self.trig["idx"], self.trig["raw"] = resample.resample_triggers(
+            self.trig["idx"], self.trig["val"], up, down, n_pnts_new
+        )
+        self._trigger_info()
+        idx = np.round(np.arange(n_pnts_new) * down / up).astype(int)
+        self.status = self.status[np.minimum(idx, n_pnts - 1)]
+
+    def filter(self, ftype, freq, order=2, n_threads=1):
+        """
+        Zero-phase filter data (see biosemipy.filters).
+        :param ftype: string "high", "low", "band" or "notch"
+        :param freq: float or list
+        :param order: int
+        :param n_threads: int (0 uses all available cores)
+        """
 
-        # adjust trigger index
-        self.trig["raw"] = np.zeros(np.shape(self.data)[1])
-        self.trig["idx"] = np.divide(self.trig["idx"], factor).astype(int)
-        self.trig["raw"][self.trig["idx"]] = self.trig["val"]
+        self.scale_data()
+        self.data = filters.filtfilt(
+            np.asarray(self.data), ftype, freq, self.freq, order, n_threads
+        )
 
     def delete_channels(self, chans):
         """
@@ -305,8 +524,88 @@ class BDF:
         """Re-reference"""
 
         chans = self._channel_idx(chans)[:-1]
+        self.scale_data()
         self.data -= self.data[chans, :].mean(0)
 
+    def scale_data(self, dtype="float64"):
+        """
+        Apply hdr["scale"] to data stored as raw counts (dtype="int32").
+        Data that is already scaled is left unchanged.
+        :param dtype: string "float64" (default) or "float32"
+        """
+
+        data = np.asarray(self.data)
+        if np.issubdtype(data.dtype, np.integer):
+            sf = np.array(self.hdr["scale"][:-1], dtype=dtype)
+            self.data = data * sf[:, None]
+
+    def epochs(self, event_values, tmin, tmax, baseline=None, dtype=None):
+        """
+        Extract epochs (epochs by channels by timepoints) from tmin to tmax
+        (seconds, tmax exclusive) around the onsets of triggers with values
+        in event_values. Epochs extending beyond the data are dropped.
+        Without baseline and dtype, the epochs are a read-only view of the
+        data (equally spaced onsets, no copy) or one vectorized gather of
+        the windows; otherwise the gathered epochs are converted to dtype
+        (raw counts are scaled) and the mean from baseline[0] to
+        baseline[1] (seconds) is subtracted from each epoch and channel.
+        With lazy data, only the records spanned by the epochs are decoded.
+        :param event_values: int/list
+        :param tmin: float
+        :param tmax: float
+        :param baseline: None/list
+        :param dtype: None/string
+        :return: epochs, trigger values of the epochs
+        """
+
+        onsets, val, n_samps = _epoch_onsets(
+            self.trig["idx"],
+            self.trig["val"],
+            self.freq,
+            np.shape(self.data)[1],
+            event_values,
+            tmin,
+            tmax,
+        )
+
+        if isinstance(self.data, LazyData):
+            epochs = self.data.epochs(onsets, n_samps)
+            data = epochs
+        else:
+            data = np.asarray(self.data)
+            step = np.unique(np.diff(onsets))
+            if baseline is None and dtype is None and len(step) <= 1:
+                # equally spaced windows share one strided view
+                step = step[0] if len(step) else 0
+                start = onsets[0] if len(onsets) else 0
+                shape = (len(onsets), data.shape[0], n_samps)
+                strides = (step * data.strides[1], data.strides[0], data.strides[1])
+                return (
+                    np.lib.stride_tricks.as_strided(
+                        data[:, start:], shape, strides, writeable=False
+                    ),
+                    val,
+                )
+
+            windows = np.lib.stride_tricks.sliding_window_view(data, n_samps, axis=1)
+            epochs = windows.transpose(1, 0, 2)[onsets]
+
+        if baseline is None and dtype is None:
+            return epochs, val
+
+        if dtype is None:
+            floating = np.issubdtype(data.dtype, np.floating)
+            dtype = data.dtype if floating else "float64"
+        if np.issubdtype(epochs.dtype, np.integer):
+            sf = np.array(self.hdr["scale"][:-1], dtype=dtype)
+            epochs = epochs * sf[None, :, None]
+        epochs = epochs.astype(dtype, copy=False)
+
+        if baseline is not None:
+            _baseline(epochs, baseline, tmin, self.freq)
+
+        return epochs, val
+
     def _channel_idx(self, chans):
         """
         Check requested chan index is in the datafile and if entered as string,
@@ -334,28 +633,100 @@ class BDF:
 
         return np.sort(np.unique(chan_out)).tolist()
 
-    def _bdf2matrix(self, bdf_dat, chans):
+    def _bdf2matrix(self, bdf_dat, chans, n_threads=1, dtype="float64"):
         """Convert vector to matric (channels by timepoints).
         :param bdf_dat: numpy vector
         :param chans: list of channels
+        :param n_threads: int
+        :param dtype: string
         """
 
         chans_bool = np.zeros(self.hdr["n_chans"], dtype=bool)
         chans_bool[chans] = True
 
-        data, trig, status = _bdf2matrix(
+        data, trig, status = _decode(
             bdf_dat,
             chans_bool,
             self.hdr["scale"],
             self.hdr["n_chans"],
             self.hdr["n_recs"],
             self.hdr["n_samps"][0],
+            n_threads,
+            dtype,
         )
 
         self.data = data
         self.trig = {"raw": trig}
         self.status = status
 
+    def _record_range(self, start, stop, units):
+        """
+        Convert start/stop in seconds, samples or records to the range of
+        data records covering this span.
+        :param start: int/float
+        :param stop: int/float
+        :param units: string
+        :return: rec_start, rec_stop (exclusive)
+        """
+
+        assert units in ["seconds", "samples", "records"], "units not recognized"
+
+        n_recs = self.hdr["n_recs"]
+        per_rec = {
+            "seconds": self.hdr["dur_recs"],
+            "samples": self.hdr["n_samps"][0],
+            "records": 1,
+        }[units]
+
+        rec_start = 0 if start is None else int(np.floor(start / per_rec))
+        rec_stop = n_recs if stop is None else int(np.ceil(stop / per_rec))
+        rec_start = min(max(rec_start, 0), n_recs)
+        rec_stop = min(max(rec_stop, rec_start), n_recs)
+
+        return rec_start, rec_stop
+
+    def _memmap(self, fname, chans, offset, n_threads=1, dtype="float64"):
+        """Memory-map data records and decode the trigger channel only.
+        :param fname: string
+        :param chans: list of channels
+        :param offset: int byte offset of the first data record
+        :param n_threads: int
+        :param dtype: string
+        """
+
+        self.data = self._lazy_data(fname, chans, offset, n_threads, dtype)
+        _, trig, status = self.data.decode(0, self.hdr["n_recs"], [])
+        self.trig = {"raw": trig}
+        self.status = status
+
+    def _lazy_data(self, fname, chans, offset, n_threads=1, dtype="float64"):
+        """Return LazyData over the data records of the file.
+        :param fname: string
+        :param chans: list of channels
+        :param offset: int byte offset of the first data record
+        :param n_threads: int
+        :param dtype: string
+        :return: LazyData
+        """
+
+        return LazyData(
+            fname,
+            chans,
+            self.hdr["scale"],
+            offset,
+            self.hdr["n_chans"],
+            self.hdr["n_recs"],
+            self.hdr["n_samps"][0],
+            n_threads,
+            dtype,
+        )
+
+    def load(self):
+        """Decode all lazily mapped data records into memory."""
+
+        if isinstance(self.data, LazyData):
+            self.data = np.asarray(self.data)
+
     def _update_header(self, chans, update_labels=True):
         """
         Update the information stored in the header field if a subset of
@@ -412,27 +783,927 @@ class BDF:
         return dict(zip(values, count))
 
 
-@jit(nopython=True)
-def _bdf2matrix(bdf_dat, chans, scale, n_chans, n_recs, n_samps):
+class BDFWriter:
+    """
+    Write a bdf file record by record. The header is serialised once and
+    n_recs is updated on close to the number of records written, e.g.
+    with BDFWriter(fname, bdf.hdr) as writer:
+        for data, trig, status, _ in bdf.iter_chunks(60):
+            writer.write_records(data, trig, status)
+    """
+
+    def __init__(self, fname, hdr):
+        """
+        :param fname: string
+        :param hdr: dict (header as in BDF.hdr)
+        """
+
+        self.fname = fname
+        self.hdr = hdr
+        self.n_recs = 0
+        self.n_chans = hdr["n_chans"]
+        self.n_samps = hdr["n_samps"][0]
+        self.scale = np.array(hdr["scale"][:-1], dtype=np.float64)
+        self.file = open(fname, "wb")
+        self.file.write(_header_bytes(hdr))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_records(self, data, trig, status):
+        """
+        Encode and append complete data records.
+        :param data: numpy matrix (channels by timepoints, scaled or int32 counts)
+        :param trig: numpy vector
+        :param status: numpy vector
+        """
+
+        data = np.asarray(data)
+        n_pnts = np.shape(data)[1]
+        assert np.shape(data)[0] == self.n_chans - 1, "Diff number of channels!"
+        assert n_pnts % self.n_samps == 0, "Data not a multiple of record length!"
+
+        if not np.issubdtype(data.dtype, np.integer):  # else raw counts
+            data = np.round(data / self.scale[:, None])
+
+        n_recs = n_pnts // self.n_samps
+        bdf = _matrix2bdf(
+            data.astype(np.int32),
+            np.asarray(trig).astype(np.int32),
+            np.asarray(status).astype(np.int32),
+            n_recs,
+            self.n_samps,
+            self.n_chans,
+        )
+        bdf.tofile(self.file)
+        self.n_recs += n_recs
+
+    def close(self):
+        """Update n_recs in the header and close the file."""
+
+        if self.file.closed:
+            return
+        if self.n_recs != self.hdr["n_recs"]:
+            self.file.seek(_N_RECS_POS)
+            self.file.write("{0:<8}".format(self.n_recs).encode())
+        self.file.close()
+
+
+class BDFFollower:
+    """
+    Follow a bdf file that is still being recorded (e.g., by ActiView).
+    Each poll decodes only the complete data records appended since the
+    last poll and updates the trigger information incrementally, e.g.
+    follower = BDFFollower(fname)
+    for data, trig, status, offset in follower.follow(poll_interval=0.5):
+        print(follower.trig["count"])
+    """
+
+    def __init__(self, fname, chans=None, n_threads=1, dtype="float64"):
+        """
+        :param fname: string
+        :param chans: list (default: all channels)
+        :param n_threads: int
+        :param dtype: string "float64", "float32" or "int32" (raw counts)
+        """
+
+        assert np.dtype(dtype) in _DTYPES, "dtype not recognized"
+
+        bdf = BDF(fname, hdr_only=True)
+        if chans:
+            chans = bdf._channel_idx(chans)
+        else:
+            chans = list(range(bdf.hdr["n_chans"]))
+
+        self.fname = fname
+        self.hdr = bdf.hdr
+        self.n_threads = n_threads
+        self.dtype = dtype
+        self.n_recs = 0  # number of records decoded so far
+        self.n_bytes_rec = self.hdr["n_chans"] * self.hdr["n_samps"][0] * 3
+        self.chans = np.zeros(self.hdr["n_chans"], dtype=bool)
+        self.chans[chans] = True
+        self.trig = {
+            "idx": np.array([], dtype=np.int64),
+            "val": np.array([], dtype=np.int16),
+            "count": {},
+        }
+        self._trig_last = None
+
+    def poll(self):
+        """
+        Decode complete records appended since the last call.
+        :return: data, trig, status, sample_offset or None if no new records
+        """
+
+        n_bytes = os.path.getsize(self.fname) - self.hdr["n_bytes_hdr"]
+        n_recs = n_bytes // self.n_bytes_rec - self.n_recs
+        if n_recs <= 0:
+            return None
+
+        with open(self.fname, "rb") as f:
+            f.seek(self.hdr["n_bytes_hdr"] + self.n_recs * self.n_bytes_rec)
+            bdf_dat = np.fromfile(f, dtype="uint8", count=n_recs * self.n_bytes_rec)
+
+        data, trig, status = _decode(
+            bdf_dat,
+            self.chans,
+            self.hdr["scale"],
+            self.hdr["n_chans"],
+            n_recs,
+            self.hdr["n_samps"][0],
+            self.n_threads,
+            self.dtype,
+        )
+        offset = self.n_recs * self.hdr["n_samps"][0]
+        self._update_trigger_info(trig, offset)
+        self.n_recs += n_recs
+
+        return data, trig, status, offset
+
+    def follow(self, poll_interval=1.0, timeout=None):
+        """
+        Generator yielding newly decoded records (see poll) until no new
+        records have been appended for timeout seconds.
+        :param poll_interval: float (seconds)
+        :param timeout: float (default: None, follow indefinitely)
+        :return: generator of (data, trig, status, sample_offset)
+        """
+
+        last_data = time.monotonic()
+        while timeout is None or time.monotonic() - last_data < timeout:
+            recs = self.poll()
+            if recs is None:
+                time.sleep(poll_interval)
+                continue
+            last_data = time.monotonic()
+            yield recs
+
+    def _update_trigger_info(self, trig, offset):
+        """
+        Append trigger onsets within trig (starting at sample offset) to
+        the trigger information, as BDF._trigger_info for the whole file.
+        :param trig: numpy vector
+        :param offset: int
+        """
+
+        if len(trig) == 0:
+            return
+        last = trig[:1] if self._trig_last is None else self._trig_last
+        self._trig_last = trig[-1:]
+
+        idx = np.where(np.diff(np.concatenate([last, trig])) >= 1)[0]
+        val = trig[idx]
+        self.trig["idx"] = np.concatenate([self.trig["idx"], idx + offset])
+        self.trig["val"] = np.concatenate([self.trig["val"], val])
+        for value, count in zip(*np.unique(val, return_counts=True)):
+            self.trig["count"][value] = self.trig["count"].get(value, 0) + count
+
+
+def read_many(fnames, workers=None, chans=None, dtype="float64"):
+    """
+    Read many bdf files concurrently in a process pool. Decoded data is
+    returned from the worker processes via shared memory.
+    :param fnames: list of strings
+    :param workers: int (default: number of cores)
+    :param chans: list (default: all channels)
+    :param dtype: string "float64", "float32" or "int32" (raw counts)
+    :return: list of BDF, list of read times (seconds)
+    """
+
+    if workers == 1:
+        bdfs, times = [], []
+        for fname in fnames:
+            tic = time.perf_counter()
+            bdfs.append(BDF(fname, chans=list(chans) if chans else None, dtype=dtype))
+            times.append(time.perf_counter() - tic)
+        return bdfs, times
+
+    # wait for all files, so that no shared memory block is left behind
+    # when one of them fails
+    results, error = [], None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_read_shared, x, chans, dtype) for x in fnames]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                error = e if error is None else error
+
+    bdfs, times = [], []
+    try:
+        if error is not None:
+            raise error
+        for attrs, shm_name, shape, read_time in results:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            try:
+                data = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+            finally:
+                shm.close()
+
+            bdf = BDF()
+            bdf.__dict__.update(attrs)
+            bdf.data = data
+            bdfs.append(bdf)
+            times.append(read_time)
+    finally:
+        for _, shm_name, _, _ in results:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            shm.close()
+            shm.unlink()
+
+    return bdfs, times
+
+
+def _read_shared(fname, chans, dtype):
+    """
+    Worker for read_many: read bdf file and place data in shared memory.
+    :param fname: string
+    :param chans: list
+    :param dtype: string
+    :return: BDF attributes (without data), shared memory name, shape, time
+    """
+
+    tic = time.perf_counter()
+    bdf = BDF(fname, chans=list(chans) if chans else None, dtype=dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(bdf.data.nbytes, 1))
+    np.ndarray(bdf.data.shape, dtype=bdf.data.dtype, buffer=shm.buf)[:] = bdf.data
+    shm.close()
+    if os.name == "posix":  # block is unlinked by the parent process
+        resource_tracker.unregister(shm._name, "shared_memory")
+    read_time = time.perf_counter() - tic
+
+    attrs = {k: v for k, v in bdf.__dict__.items() if k != "data"}
+
+    return attrs, shm.name, bdf.data.shape, read_time
+
+
+def read_events(fname, cache=True):
+    """
+    Read trigger information decoding only the Status channel. With cache,
+    the result is stored in a sidecar file (fname + ".events.npz") that is
+    reused while the size, modification time and header of fname match.
+    :param fname: string
+    :param cache: bool (default: True)
+    :return: dict with idx, val and count (as BDF.trig)
+    """
+
+    key = _file_key(fname)
+    fname_cache = fname + _EVENTS_EXT
+
+    if cache and os.path.isfile(fname_cache):
+        try:
+            with np.load(fname_cache) as npz:
+                if npz["key"].item() == key:
+                    idx, val = npz["idx"], npz["val"]
+                    count = dict(zip(npz["count_val"], npz["count_n"]))
+                    return {"idx": idx, "val": val, "count": count}
+        except (OSError, ValueError, KeyError):  # invalid cache, re-read
+            pass
+
+    trig = BDF(fname, lazy=True).trig
+    events = {"idx": trig["idx"], "val": trig["val"], "count": trig["count"]}
+
+    if cache:
+        try:
+            fname_tmp = f"{fname_cache}.{os.getpid()}.tmp"
+            with open(fname_tmp, "wb") as f:
+                np.savez(
+                    f,
+                    key=np.array(key),
+                    idx=events["idx"],
+                    val=events["val"],
+                    count_val=np.array(list(events["count"].keys())),
+                    count_n=np.array(list(events["count"].values())),
+                )
+            os.replace(fname_tmp, fname_cache)
+        except OSError:  # e.g., read only directory
+            pass
+
+    return events
+
+
+def read_epochs(
+    fname,
+    event_values,
+    tmin,
+    tmax,
+    chans=None,
+    baseline=None,
+    n_threads=1,
+    dtype="float64",
+):
+    """
+    Read epochs (epochs by channels by timepoints) around triggers directly
+    from disk, as BDF.epochs. Trigger onsets are taken from read_events
+    (cached) and only the data records spanned by the epochs are decoded,
+    so sparse events in a large file require reading only a few records.
+    :param fname: string
+    :param event_values: int/list
+    :param tmin: float
+    :param tmax: float
+    :param chans: list (default: all channels)
+    :param baseline: None/list
+    :param n_threads: int
+    :param dtype: string "float64", "float32" or "int32" (raw counts, scaled
+        to float64 with baseline)
+    :return: epochs, trigger values of the epochs
+    """
+
+    assert np.dtype(dtype) in _DTYPES, "dtype not recognized"
+
+    bdf = BDF(fname, hdr_only=True)
+    if chans:
+        chans = bdf._channel_idx(chans)
+    else:
+        chans = list(range(bdf.hdr["n_chans"]))
+    data = bdf._lazy_data(fname, chans, bdf.hdr["n_bytes_hdr"], n_threads, dtype)
+
+    freq = bdf.hdr["freq"][0]
+    events = read_events(fname)
+    onsets, val, n_samps = _epoch_onsets(
+        events["idx"], events["val"], freq, data.shape[1], event_values, tmin, tmax
+    )
+    epochs = data.epochs(onsets, n_samps)
+
+    if baseline is not None:
+        if np.issubdtype(epochs.dtype, np.integer):  # scale raw counts
+            epochs = epochs * data.scale[data.chans][None, :, None]
+        _baseline(epochs, baseline, tmin, freq)
+
+    return epochs, val
+
+
+def _epoch_onsets(idx, val, freq, n_pnts, event_values, tmin, tmax):
+    """
+    First sample of each epoch around triggers with values in event_values,
+    excluding epochs that extend beyond the data.
+    :param idx: numpy vector (trigger onsets)
+    :param val: numpy vector (trigger values)
+    :param freq: int
+    :param n_pnts: int (length of data)
+    :param event_values: int/list
+    :param tmin: float
+    :param tmax: float
+    :return: onsets, trigger values, number of samples per epoch
+    """
+
+    assert tmax > tmin, "tmax should be larger than tmin"
+    start = int(round(tmin * freq))
+    n_samps = int(round(tmax * freq)) - start
+
+    onsets = np.asarray(idx) + start
+    keep = np.isin(val, np.atleast_1d(event_values))
+    keep &= (onsets >= 0) & (onsets + n_samps <= n_pnts)
+
+    return onsets[keep], np.asarray(val)[keep], n_samps
+
+
+def _baseline(epochs, baseline, tmin, freq):
+    """
+    Subtract the mean from baseline[0] to baseline[1] (seconds) from each
+    epoch and channel (in place).
+    :param epochs: numpy array (epochs by channels by timepoints)
+    :param baseline: list
+    :param tmin: float (time of first epoch sample)
+    :param freq: int
+    """
+
+    assert np.issubdtype(epochs.dtype, np.floating), "baseline requires float data"
+    b0 = int(round((baseline[0] - tmin) * freq))
+    b1 = int(round((baseline[1] - tmin) * freq))
+    assert 0 <= b0 < b1 <= epochs.shape[2], "baseline outside of epoch"
+    epochs -= epochs[:, :, b0:b1].mean(axis=2, keepdims=True)
+
+
+def _file_key(fname):
+    """
+    Identify the current contents of a bdf file by its size, modification
+    time and a hash of its header.
+    :param fname: string
+    :return: string
+    """
+
+    stat = os.stat(fname)
+    with open(fname, "rb") as f:
+        buf = f.read(256)
+        buf += f.read(256 * int(buf[252:256]))
+
+    return f"{stat.st_size}:{stat.st_mtime_ns}:{hashlib.sha1(buf).hexdigest()}"
+
+
+def _cache_fname(cache_dir, fname, chans, rec_start, rec_stop, dtype):
+    """
+    Cache filename (without extension) for decoded data of a bdf file.
+    Changes to the source file give a new name (see _file_key).
+    :param cache_dir: string
+    :param fname: string
+    :param chans: list of channels
+    :param rec_start: int
+    :param rec_stop: int
+    :param dtype: string
+    :return: string
+    """
+
+    key = f"{os.path.abspath(fname)}|{_file_key(fname)}|{chans}"
+    key += f"|{rec_start}|{rec_stop}|{np.dtype(dtype).name}"
+
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest())
+
+
+def _cache_load(fname_cache):
+    """
+    Memory-map cached decoded data (copy-on-write, the cache file is never
+    modified) and mark it as recently used.
+    :param fname_cache: string
+    :return: data, trig, status or None if not cached
+    """
+
+    try:
+        data = np.load(fname_cache + ".npy", mmap_mode="c")
+        trig, status = np.load(fname_cache + ".trig.npy")
+        os.utime(fname_cache + ".npy")
+    except (OSError, ValueError):
+        return None
+
+    return data, trig, status
+
+
+def _cache_store(fname_cache, data, trig, status, cache_size=None):
+    """
+    Store decoded data in the cache and remove least recently used entries
+    until the cache is within cache_size bytes.
+    :param fname_cache: string
+    :param data: numpy matrix
+    :param trig: numpy vector
+    :param status: numpy vector
+    :param cache_size: int (default: _CACHE_SIZE)
+    """
+
+    cache_dir = os.path.dirname(fname_cache)
+    fname_tmp = f"{fname_cache}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for ext, dat in [(".trig.npy", np.vstack([trig, status])), (".npy", data)]:
+            with open(fname_tmp, "wb") as f:
+                np.save(f, dat)
+            os.replace(fname_tmp, fname_cache + ext)
+    except OSError:  # e.g., read only directory or disk full
+        if os.path.isfile(fname_tmp):
+            os.remove(fname_tmp)
+        return
+
+    # least recently used eviction (data files are touched when loaded),
+    # entries may be removed concurrently by other processes
+    if cache_size is None:
+        cache_size = _CACHE_SIZE
+    entries = []
+    for x in os.scandir(cache_dir):
+        if x.name.endswith(".npy") and not x.name.endswith(".trig.npy"):
+            root = x.path[: -len(".npy")]
+            try:
+                stat = x.stat()
+                size = stat.st_size + os.path.getsize(root + ".trig.npy")
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, size, root))
+    entries.sort()
+    total = sum(x[1] for x in entries)
+    for _, size, root in entries:
+        if total <= cache_size or root == fname_cache:
+            break
+        for ext in [".npy", ".trig.npy"]:
+            try:
+                os.remove(root + ext)
+            except FileNotFoundError:
+                pass
+        total -= size
+
+
+def merge_files(fname, *fnames):
+    """
+    Merge bdf files on disk without decoding. Data records are copied
+    byte for byte after the header of the first file (n_recs updated).
+    :param fname: string (output file)
+    :param fnames: strings (input files)
+    """
+
+    hdrs = [BDF(x, hdr_only=True).hdr for x in fnames]
+
+    # check datafiles can be merged appropriately
+    for x in hdrs:
+        assert x["n_recs"] != -1, "Unknown number of records (n_recs = -1)!"
+    for x in hdrs[1:]:
+        assert hdrs[0]["n_chans"] == x["n_chans"], "Diff number of channels!"
+        assert hdrs[0]["labels"] == x["labels"], "Diff channel labels!"
+        assert hdrs[0]["n_samps"] == x["n_samps"], "Diff sample rate!"
+        assert hdrs[0]["dur_recs"] == x["dur_recs"], "Diff record duration!"
+        for field in ["pmin", "pmax", "dmin", "dmax"]:
+            assert np.array_equal(hdrs[0][field], x[field]), "Diff channel scaling!"
+
+    hdr = dict(hdrs[0])
+    hdr["n_recs"] = sum(x["n_recs"] for x in hdrs)
+    hdr["n_bytes_hdr"] = (hdr["n_chans"] + 1) * 256
+    n_bytes_rec = hdr["n_chans"] * hdr["n_samps"][0] * 3
+
+    print(f"Writing to file {fname}")
+    with open(fname, "wb") as out:
+        out.write(_header_bytes(hdr))
+        for x, x_hdr in zip(fnames, hdrs):
+            with open(x, "rb") as f:
+                _copy_bytes(
+                    f, out, x_hdr["n_bytes_hdr"], x_hdr["n_recs"] * n_bytes_rec
+                )
+
+
+def crop_file(fname, fname_out, crop_type, val):
+    """
+    Crop bdf file on disk without decoding the data channels. As
+    BDF.crop, the border can be defined using either a start and end
+    trigger ("triggers", 0 = start/end of file) or a start and end record
+    ("records", first record is 1). Only the Status channel is decoded.
+    :param fname: string
+    :param fname_out: string
+    :param crop_type: string
+    :param val: list
+    """
+
+    assert len(val) == 2, "val should be of length 2"
+    assert crop_type in ["triggers", "records"], "crop_type not recognized"
+
+    bdf = BDF(fname, lazy=True)
+    n_samps = bdf.hdr["n_samps"][0]
+
+    if crop_type == "triggers":
+        idx_start = 0
+        if val[0] != 0:  # from start of file
+            idx_start = bdf.trig["idx"][np.where(bdf.trig["val"] == val[0])[0][0]]
+        idx_end = bdf.hdr["n_recs"] * n_samps
+        if val[1] != 0:  # to end of file
+            idx_end = bdf.trig["idx"][np.where(bdf.trig["val"] == val[1])[0][-1]]
+
+        # need to find boundary equal to record breaks
+        rec_start = -(-idx_start // n_samps)
+        rec_stop = idx_end // n_samps
+
+    elif crop_type == "records":
+        rec_start = val[0] - 1
+        rec_stop = val[1]
+
+    _copy_records(fname, bdf.hdr, [(fname_out, rec_start, rec_stop)])
+
+
+def split_file(fname, trigger, fname_out=None):
+    """
+    Split bdf file on disk into one file per block, where each block
+    starts with the record containing the onset of a trigger value in
+    trigger and runs until the next block (or the end of the file).
+    Records before the first block are not written. Only the Status
+    channel is decoded and the input is read in a single pass.
+    :param fname: string
+    :param trigger: int/list
+    :param fname_out: list of strings (default: fname_1.bdf, fname_2.bdf, ...)
+    :return: list of output filenames
+    """
+
+    bdf = BDF(fname, lazy=True)
+    n_samps = bdf.hdr["n_samps"][0]
+
+    idx = bdf.trig["idx"][np.isin(bdf.trig["val"], trigger)]
+    borders = np.unique(idx // n_samps).tolist() + [bdf.hdr["n_recs"]]
+
+    if fname_out is None:
+        root, ext = os.path.splitext(fname)
+        fname_out = [f"{root}_{i + 1}{ext}" for i in range(len(borders) - 1)]
+    assert len(fname_out) == len(borders) - 1, "Diff number of output files!"
+
+    _copy_records(fname, bdf.hdr, list(zip(fname_out, borders[:-1], borders[1:])))
+
+    return fname_out
+
+
+def _copy_records(fname, hdr, outputs):
+    """
+    Copy ranges of data records from fname into new files, each with its
+    own header (n_recs updated).
+    :param fname: string
+    :param hdr: dict (header of fname)
+    :param outputs: list of (fname_out, rec_start, rec_stop) tuples
+    """
+
+    n_bytes_rec = hdr["n_chans"] * hdr["n_samps"][0] * 3
+    n_bytes_hdr = (hdr["n_chans"] + 1) * 256
+
+    with open(fname, "rb") as f:
+        for fname_out, rec_start, rec_stop in outputs:
+            assert 0 <= rec_start < rec_stop <= hdr["n_recs"], "Invalid records!"
+            print(f"Writing to file {fname_out}")
+            with open(fname_out, "wb") as out:
+                out.write(_header_bytes(dict(hdr, n_recs=rec_stop - rec_start)))
+                _copy_bytes(
+                    f,
+                    out,
+                    n_bytes_hdr + rec_start * n_bytes_rec,
+                    (rec_stop - rec_start) * n_bytes_rec,
+                )
+
+
+def _copy_bytes(src, dst, offset, count):
+    """
+    Append count bytes of src starting at offset to dst, in kernel space
+    (os.copy_file_range) where available.
+    :param src: file object
+    :param dst: file object
+    :param offset: int
+    :param count: int
+    """
+
+    dst.flush()
+    try:
+        while count > 0:
+            n_bytes = os.copy_file_range(src.fileno(), dst.fileno(), count, offset)
+            if n_bytes == 0:
+                break
+            offset += n_bytes
+            count -= n_bytes
+    except (AttributeError, OSError):  # not supported by platform/filesystem
+        src.seek(offset)
+        while count > 0:
+            buf = src.read(min(count, _COPY_N_BYTES))
+            if not buf:
+                break
+            dst.write(buf)
+            count -= len(buf)
+
+    assert count == 0, f"File {src.name} shorter than n_recs in header!"
+
+
+# per channel header fields and their widths in bytes (in file order)
+_HDR_CHAN_FIELDS = [
+    ("labels", 16),
+    ("type", 80),
+    ("unit", 8),
+    ("pmin", 8),
+    ("pmax", 8),
+    ("dmin", 8),
+    ("dmax", 8),
+    ("filter", 80),
+    ("n_samps", 8),
+    ("reserved", 32),
+]
+_CACHE_SIZE = 8 * 2**30  # default size limit of decoded data cache in bytes
+_EVENTS_EXT = ".events.npz"  # sidecar cache file extension used by read_events
+_COPY_N_BYTES = 2**24  # block size when copying records in user space
+_EPOCH_N_RECS = 60  # maximum records decoded at once by LazyData.epochs
+_WRITE_N_RECS = 60  # records encoded per block by BDF.write
+_N_RECS_POS = 236  # byte position of n_recs within the header
+
+
+def _header_bytes(hdr):
+    """
+    Serialise header dict (as in BDF.hdr) to bytes.
+    :param hdr: dict
+    :return: bytes
+    """
+
+    fields = [
+        "{0:<7}".format(hdr["id2"]),
+        "{0:<80}".format(hdr["text1"]),
+        "{0:<80}".format(hdr["text2"]),
+        "{0:<8}".format(hdr["date"]),
+        "{0:<8}".format(hdr["time"]),
+        "{0:<8}".format(hdr["n_bytes_hdr"]),
+        "{0:<44}".format(hdr["format"]),
+        "{0:<8}".format(hdr["n_recs"]),
+        "{0:<8}".format(hdr["dur_recs"]),
+        "{0:<4}".format(hdr["n_chans"]),
+    ]
+    for field, width in _HDR_CHAN_FIELDS:
+        fields += ["{0:<{1}}".format(x, width) for x in hdr[field]]
+
+    return b"\xff" + "".join(fields).encode("latin-1")
+
+
+class LazyData:
+    """
+    Array-like access to the data channels of a memory-mapped bdf file.
+    Only the data records covered by an index are decoded, e.g.
+    data[:, t0:t1] or data[[0, 3], t0:t1].
+    """
+
+    def __init__(
+        self,
+        fname,
+        chans,
+        scale,
+        offset,
+        n_chans,
+        n_recs,
+        n_samps,
+        n_threads=1,
+        dtype="float64",
+    ):
+        """
+        :param fname: string
+        :param chans: list of channels (file index, last is Status channel)
+        :param scale: numpy array
+        :param offset: int byte offset of the first data record
+        :param n_chans: int
+        :param n_recs: int
+        :param n_samps: int
+        :param n_threads: int
+        :param dtype: string
+        """
+
+        self.chans = list(chans[:-1])
+        self.scale = np.asarray(scale)
+        self.n_chans = n_chans
+        self.n_recs = n_recs
+        self.n_samps = n_samps
+        self.n_threads = n_threads
+        self.dtype = np.dtype(dtype)
+        self.mmap = np.memmap(
+            fname,
+            dtype="uint8",
+            mode="r",
+            offset=offset,
+            shape=(n_recs, n_chans, n_samps * 3),
+        )
+
+    @property
+    def shape(self):
+        return len(self.chans), self.n_recs * self.n_samps
+
+    @property
+    def ndim(self):
+        return 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:, :]
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        assert len(key) == 2, "LazyData supports 2D indexing only"
+        chan_key, samp_key = key
+
+        chans = np.asarray(self.chans)[chan_key]
+        n_pnts = self.shape[1]
+
+        if isinstance(samp_key, slice) and samp_key.step in (None, 1):
+            start, stop, _ = samp_key.indices(n_pnts)
+            stop = max(start, stop)
+            idx = slice(None)
+        else:  # int, negative step slice or index array
+            idx = np.arange(n_pnts)[samp_key]
+            if np.size(idx) == 0:
+                start, stop = 0, 0
+            else:
+                start, stop = int(np.min(idx)), int(np.max(idx)) + 1
+            idx = idx - start
+
+        # kernel output is in file channel order
+        chans_unique, chans_order = np.unique(chans, return_inverse=True)
+
+        rec_start = start // self.n_samps
+        rec_stop = -(-stop // self.n_samps)
+        data, _, _ = self.decode(rec_start, rec_stop, chans_unique)
+        offset = start - rec_start * self.n_samps
+        data = data[chans_order.reshape(-1), offset : offset + stop - start][:, idx]
+
+        return data[0] if np.ndim(chans) == 0 else data
+
+    def epochs(self, onsets, n_samps):
+        """
+        Decode windows of n_samps samples starting at onsets. Only the data
+        records spanned by the windows are decoded; windows with overlapping
+        or adjacent record ranges are decoded together (up to
+        _EPOCH_N_RECS records per range).
+        :param onsets: numpy vector
+        :param n_samps: int
+        :return: numpy array (epochs by channels by timepoints)
+        """
+
+        onsets = np.asarray(onsets, dtype=np.int64)
+        epochs = np.empty((len(onsets), len(self.chans), n_samps), dtype=self.dtype)
+        chans_unique, chans_order = np.unique(self.chans, return_inverse=True)
+
+        rec_start = onsets // self.n_samps
+        rec_stop = -(-(onsets + n_samps) // self.n_samps)
+        order = np.argsort(rec_start, kind="stable")
+
+        i = 0
+        while i < len(order):
+            start, stop = rec_start[order[i]], rec_stop[order[i]]
+            j = i + 1
+            while j < len(order) and rec_start[order[j]] <= stop:
+                if max(stop, rec_stop[order[j]]) - start > _EPOCH_N_RECS:
+                    break
+                stop = max(stop, rec_stop[order[j]])
+                j += 1
+
+            data, _, _ = self.decode(start, stop, chans_unique)
+            data = data[chans_order.reshape(-1)]
+            for epoch in order[i:j]:
+                pos = onsets[epoch] - start * self.n_samps
+                epochs[epoch] = data[:, pos : pos + n_samps]
+            i = j
+
+        return epochs
+
+    def decode(self, rec_start, rec_stop, chans):
+        """
+        Decode data records rec_start to rec_stop (exclusive).
+        :param rec_start: int
+        :param rec_stop: int
+        :param chans: list of channels (file index, excluding Status channel)
+        :return: data, trig, status
+        """
+
+        chans = sorted(set(int(x) for x in chans)) + [self.n_chans - 1]
+
+        # strided gather: only the byte ranges of the selected channels
+        # within each record are read from disk
+        recs = self.mmap[rec_start:rec_stop]
+        if len(chans) < self.n_chans:
+            recs = recs[:, chans]
+
+        return _decode(
+            np.ascontiguousarray(recs).reshape(-1),
+            np.ones(len(chans), dtype=bool),
+            self.scale[chans],
+            len(chans),
+            rec_stop - rec_start,
+            self.n_samps,
+            self.n_threads,
+            self.dtype,
+        )
+
+
+_DTYPES = [np.dtype(np.float64), np.dtype(np.float32), np.dtype(np.int32)]
+
+
+def _decode(
+    bdf_dat, chans, scale, n_chans, n_recs, n_samps, n_threads=1, dtype="float64"
+):
+    """
+    Run the serial (n_threads=1) or parallel _bdf2matrix kernel.
+    :param n_threads: int (0 uses all available cores)
+    :param dtype: string "float64", "float32" or "int32" (raw counts)
+    :return: data, trig, status
+    """
+
+    dtype = np.dtype(dtype)
+    data = np.empty((np.sum(chans) - 1, n_recs * n_samps), dtype=dtype)
+    if np.issubdtype(dtype, np.integer):  # raw counts
+        scale = np.ones(len(scale))
+
+    args = (bdf_dat, chans, np.asarray(scale, dtype=np.float64), data)
+    args += (n_chans, n_recs, n_samps)
+    if n_threads == 1:
+        return _bdf2matrix(*args)
+
+    n_threads_prev = get_num_threads()
+    if n_threads <= 0 or n_threads > config.NUMBA_NUM_THREADS:
+        n_threads = config.NUMBA_NUM_THREADS
+    set_num_threads(n_threads)
+    try:
+        return _bdf2matrix_parallel(*args)
+    finally:
+        set_num_threads(n_threads_prev)
+
+
+# nogil: decoding (including page faults of memory-mapped input) does not
+# block other threads, e.g. the dataviewer gui while a file is loading
+@jit(nopython=True, nogil=True)
+def _bdf2matrix(bdf_dat, chans, scale, data, n_chans, n_recs, n_samps):
     """
     Take remaining data in bdf_dat and assign to n channels
     by n time points numpy matrix.
     :param bdf_dat: numpy matrix
     :param chans: numpy bool array
     :param scale: numpy array
+    :param data: numpy matrix (output, channels by timepoints)
     :param n_chans: int
     :param n_recs: int
     :param n_samps: int
     :return: numpy matrix (channels by timepoints)
     """
 
-    data = np.zeros((np.sum(chans) - 1, n_recs * n_samps), dtype=np.float64)
     trig = np.zeros(n_recs * n_samps, dtype=np.int16)
     status = np.zeros(n_recs * n_samps, dtype=np.int16)
 
-    pos = 0
-    for rec in range(n_recs):
+    # records are independent (prange is range unless compiled parallel)
+    for rec in prange(n_recs):
         offset = rec * n_samps
+        pos = rec * n_chans * n_samps * 3
         idx = 0
         for chan in range(n_chans):
             if chans[chan]:
@@ -446,7 +1717,7 @@ def _bdf2matrix(bdf_dat, chans, scale, n_chans, n_recs, n_samps):
                         if val >= 2**23:
                             val -= 2**24
 
-                        data[idx, offset + samp] = np.float64(val * scale[chan])
+                        data[idx, offset + samp] = val * scale[chan]
 
                         pos += 3
                 else:  # last channel is always Status channel
@@ -464,6 +1735,11 @@ def _bdf2matrix(bdf_dat, chans, scale, n_chans, n_recs, n_samps):
     return data, trig, status
 
 
+_bdf2matrix_parallel = jit(nopython=True, parallel=True, nogil=True)(
+    _bdf2matrix.py_func
+)
+
+
 @jit(nopython=True)
 def _matrix2bdf(data, trig, status, n_recs, n_samps, n_chans):
     """
@@ -495,9 +1771,9 @@ def _matrix2bdf(data, trig, status, n_recs, n_samps, n_chans):
                 for samp in range(n_samps):
                     trig_val = trig[rec * n_samps + samp]
                     status_val = status[rec * n_samps + samp]
-                    bdf[pos] = np.uint8(trig_val)
-                    bdf[pos + 1] = np.uint8(status_val) >> 8
-                    bdf[pos + 2] = np.uint8(status_val)
+                    bdf[pos] = np.uint8(trig_val & 0xFF)
+                    bdf[pos + 1] = np.uint8((trig_val >> 8) & 0xFF)
+                    bdf[pos + 2] = np.uint8(status_val & 0xFF)
                     pos += 3
 
     return bdf
@@ -5,13 +5,15 @@ DataViewer: PyQt5-based gui for viewing *.bdf files
 import argparse
 import os
 import sys
-from collections import deque
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 import numpy as np
 import pyqtgraph as pg
 from PyQt6 import QtGui
-from PyQt6.QtCore import QTimer
+from PyQt6.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt6.QtWidgets import (
     QApplication,
     QAbstractItemView,
@@ -19,12 +21,14 @@ from PyQt6.QtWidgets import (
     QInputDialog,
     QMainWindow,
     QMessageBox,
+    QProgressDialog,
 )
 import matplotlib.pyplot as plt
 from matplotlib import colormaps
-from scipy import signal
 
-from biosemipy.bdf import BDF
+from biosemipy import filters
+from biosemipy.bdf import BDF, read_many
+from biosemipy.lod import MinMaxPyramid, envelope
 from biosemipy.topo import Topo
 from biosemipy.gui.channel_difference import ChannelDifference
 from biosemipy.gui.channel_selection import ChannelSelection
@@ -67,6 +71,7 @@ class DataViewer(QMainWindow):
         self.bdf = None
         self.data = None
         self.time = None
+        self.lod = None
         self.layout_file = layout_file
         self.topo = None
         self.n_channels = None
@@ -80,11 +85,29 @@ class DataViewer(QMainWindow):
         self.channel_selection = []
         self.event_items = []
 
+        # batched mode: all channels drawn as one curve item
+        self.batched_plot = False
+        self.batch_item = None
+        self.batch_selected_item = None
+        self.plot_data = None
+        self.plot_time = None
+
         # signals/timers
         self.proxy = None
         self.timer = QTimer()
         self.timer.timeout.connect(self._update_plot)
         self.qt_connections = False
+        self.prefetch = WindowPrefetcher(n_windows=4)
+        self.loader = None
+        self.progress_dialog = None
+
+        # display filters: applied to the plot window only (see
+        # _filter_window), to the whole file on export
+        self.display_filter_mode = False
+        self.display_filters = []  # (ftype, freq, order), at the current rate
+        self.filter_cache = OrderedDict()
+        self.filter_lock = threading.Lock()
+        self.data_version = 0  # filter cache key, new data/file: + 1
 
         # cursor for selected channel
         self.channel_selected = None
@@ -122,10 +145,8 @@ class DataViewer(QMainWindow):
         self.plot_topography_on = False
 
         if self.fname:
+            self._set_menubar(file_loaded=False)
             self.read_bdf_file()
-            self._set_menubar(file_loaded=True)
-            self._set_plot()
-            self._update_plot()
         else:
             self._set_menubar(file_loaded=False)
             self._set_plot_blank()
@@ -175,41 +196,157 @@ class DataViewer(QMainWindow):
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
         )
 
-        event.accept() if close == QMessageBox.StandardButton.Yes else event.ignore()
+        if close == QMessageBox.StandardButton.Yes:
+            self._cancel_loading(keep=False)
+            event.accept()
+        else:
+            event.ignore()
 
     def read_bdf_file(self):
-        """Read *.bdf file."""
+        """
+        Read *.bdf file. A single file is read in a background thread
+        (FileLoader) and displayed as soon as the first records are
+        decoded, multiple files are read with read_many and merged.
+        """
 
         print(f"Reading {self.fname}")
+        if isinstance(self.fname, list) and len(self.fname) > 1:
+            self._set_bdf(self.read_bdf_files())
+            self._set_menubar(file_loaded=True)
+            return
+
         if isinstance(self.fname, list):
-            if len(self.fname) == 1:
-                self.fname = self.fname[0]
-                bdf = BDF(self.fname, chans=self.channels)
-                self.merge_filenames()
-            else:
-                bdf = self.read_bdf_files()
-        else:
-            bdf = BDF(self.fname, chans=self.channels)
+            self.fname = self.fname[0]
+
+        self._cancel_loading(keep=False)
+        self.loader = FileLoader(self.fname, self.channels, parent=self)
+        self.loader.progress.connect(partial(self._on_loading_progress, self.loader))
+        self.loader.finished.connect(partial(self._on_loading_finished, self.loader))
+
+        self.progress_dialog = QProgressDialog(
+            f"Reading {os.path.split(self.fname)[1]}", "Cancel", 0, 100, self
+        )
+        self.progress_dialog.setWindowModality(Qt.WindowModality.NonModal)
+        self.progress_dialog.setMinimumDuration(0)
+        self.progress_dialog.canceled.connect(self._cancel_loading)
+        self._set_menubar(file_loaded=False)  # enabled when loading finished
+        self.loader.start()
+
+    def _set_bdf(self, bdf, fname_lod=None):
+        """
+        Display bdf file (data may still be read in place by FileLoader).
+        :param bdf: BDF
+        :param fname_lod: string (file for the min/max envelope cache)
+        """
 
         self.bdf = bdf
         self.data = bdf.data
         self.time = bdf.time
+        self.lod = MinMaxPyramid(self.data, fname=fname_lod, chans=self.channels)
+        self.display_filters = []
+        self._clear_filter_cache()
+        self.prefetch.clear()
         self.n_channels = np.shape(self.data)[0]
         self.labels_org = bdf.hdr["labels"][:-1]
         self.labels_selected = bdf.hdr["labels"][:-1]
         self.events = bdf.trig
+        self.channel_selection = []
         self._set_slider_values()
         self._set_selection_labels()
 
-        self._set_menubar(file_loaded=True)
         self._set_qt_connections(connect=True)
+        self._set_plot()
+        self._update_plot()
+
+    def _on_loading_progress(self, loader, n_read, n_total):
+        """
+        Show the file once the first records are read, then update the
+        min/max envelopes (and plot) of the newly read samples.
+        :param loader: FileLoader
+        :param n_read: int (samples read)
+        :param n_total: int
+        """
+
+        if loader is not self.loader:  # discarded
+            return
+        if self.bdf is not loader.bdf:
+            self._set_bdf(loader.bdf)
+        else:
+            self.lod.update(loader.n_shown, n_read)
+            self.prefetch.clear()
+            self._clear_filter_cache()
+            if self.scale["xmin"] < n_read and not self.scale["x_scroll"]:
+                self._update_plot()
+        loader.n_shown = n_read
+
+        if self.progress_dialog is not None:
+            self.progress_dialog.setValue(int(100 * n_read / n_total))
+
+    def _on_loading_finished(self, loader):
+        """
+        File read completely (or cancelled): enable all file options.
+        :param loader: FileLoader
+        """
+
+        if loader is not self.loader:  # discarded
+            return
+        self.loader = None
+        if self.progress_dialog is not None:
+            self.progress_dialog.close()
+            self.progress_dialog = None
+
+        if loader.error is not None:
+            QMessageBox.warning(self, "Read Error", str(loader.error))
+        if loader.error is not None or loader.bdf.data is None or (
+            np.shape(loader.bdf.data)[1] == 0  # cancelled before any record
+        ):
+            if self.bdf is not None and self.bdf is not loader.bdf:
+                self._set_menubar(file_loaded=True)  # previous file still shown
+            return
+
+        fname_lod = None if loader.cancelled else loader.fname
+        if self.bdf is not loader.bdf:
+            self._set_bdf(loader.bdf, fname_lod)
+        else:
+            if self.data is not loader.bdf.data:  # truncated (cancelled)
+                self.data = loader.bdf.data
+                self.time = loader.bdf.time
+                self.scale["xmax"] = min(self.scale["xmax"], len(self.time) - 1)
+                self.scale["xmin"] = min(self.scale["xmin"], self.scale["xmax"] - 1)
+                self.scale["xrange"] = self.scale["xmax"] - self.scale["xmin"]
+                self.gui.x_scroll_pos_slider.setMaximum(
+                    max(len(self.time) - (self.scale["xrange"] + 1), 0)
+                )
+            self.lod = MinMaxPyramid(self.data, fname=fname_lod, chans=self.channels)
+            self._clear_filter_cache()
+            self._update_plot()
+
+        self._set_menubar(file_loaded=True)
+
+    def _cancel_loading(self, keep=True):
+        """
+        Stop reading the current file. With keep, the data read so far is
+        shown, otherwise the loader is discarded (e.g., new file).
+        :param keep: bool
+        """
+
+        if self.loader is None:
+            return
+        if self.loader.isRunning():
+            self.loader.requestInterruption()
+            self.loader.wait()
+        if not keep:
+            self.loader = None
+            if self.progress_dialog is not None:
+                self.progress_dialog.close()
+                self.progress_dialog = None
 
     def read_bdf_files(self):
         """Read multiple *.bdf files."""
 
-        bdf = []
-        for file in self.fname:
-            bdf.append(BDF(file, chans=self.channels))
+        bdf, read_times = read_many(self.fname, chans=self.channels)
+        for file, read_time in zip(self.fname, read_times):
+            print(f"Read {file} ({read_time:.2f} s)")
         self._merge_filenames()
         bdf[0].merge(self.fname, *bdf[1:])
 
@@ -403,6 +540,11 @@ class DataViewer(QMainWindow):
         line_size_action = QtGui.QAction("&Line Width", self)
         line_size_action.triggered.connect(self._select_line_width)
 
+        batched_plot_action = QtGui.QAction("&Batched Plot (single curve)", self)
+        batched_plot_action.setCheckable(True)
+        batched_plot_action.setChecked(self.batched_plot)
+        batched_plot_action.triggered.connect(self._on_batched_plot_clicked)
+
         topoplot_action = QtGui.QAction("&Topoplot", self)
         topoplot_action.triggered.connect(self.plot_topography)
 
@@ -419,13 +561,18 @@ class DataViewer(QMainWindow):
         remove_filter_action = QtGui.QAction("&Remove Filter", self)
         low_pass_filter_action = QtGui.QAction("&Low-Pass Filter", self)
         high_pass_filter_action = QtGui.QAction("&High-Pass Filter", self)
+        display_filter_action = QtGui.QAction("&Display Filter (view window)", self)
         remove_filter_action.triggered.connect(self._on_remove_filter_action)
         low_pass_filter_action.triggered.connect(self._on_low_pass_filter_action)
         high_pass_filter_action.triggered.connect(self._on_high_pass_filter_action)
+        display_filter_action.setCheckable(True)
+        display_filter_action.setChecked(self.display_filter_mode)
+        display_filter_action.triggered.connect(self._on_display_filter_clicked)
 
         data_menu.addAction(remove_filter_action)
         data_menu.addAction(low_pass_filter_action)
         data_menu.addAction(high_pass_filter_action)
+        data_menu.addAction(display_filter_action)
 
         events_menu = menu_bar.addMenu("&Events")
         events_menu.addAction(events_toggle_action)
@@ -442,6 +589,7 @@ class DataViewer(QMainWindow):
         visuals_menu.addAction(colourmap_select_action)
         visuals_menu.addAction(font_size_action)
         visuals_menu.addAction(line_size_action)
+        visuals_menu.addAction(batched_plot_action)
 
         plots_menu = menu_bar.addMenu("&Plots (other)")
         plots_menu.addAction(topoplot_action)
@@ -467,6 +615,33 @@ class DataViewer(QMainWindow):
         """Remove applied (if any) filters from data."""
 
         self.data = self.bdf.data
+        self.display_filters = []
+        self._clear_filter_cache()
+        self._update_plot()
+
+    def _on_display_filter_clicked(self):
+        """
+        Toggle display filter mode: new filters are applied to the plot
+        window only (instant preview), and to the whole file on export.
+        """
+
+        self.display_filter_mode = not self.display_filter_mode
+
+    def _add_filter(self, ftype, freq, order):
+        """
+        Filter the whole data, or add a display filter (display filter
+        mode).
+        :param ftype: string
+        :param freq: float
+        :param order: int
+        """
+
+        if self.display_filter_mode:
+            self.display_filters.append((ftype, freq, order))
+        else:
+            self.data = filters.filtfilt(
+                self.data, ftype, freq, self.bdf.freq, order=order, n_threads=0
+            )
         self._update_plot()
 
     def _on_high_pass_filter_action(self):
@@ -476,9 +651,7 @@ class DataViewer(QMainWindow):
         selection.show()
         if selection.exec():
             freq = selection.get_selection()
-            b, a = signal.butter(2, (float(freq) / (self.bdf.freq / 2)), "high")
-            self.data = signal.filtfilt(b, a, self.data)
-            self._update_plot()
+            self._add_filter("high", float(freq), order=2)
 
     def _on_low_pass_filter_action(self):
         """Apply low-pass fir filter using MNE defaults"""
@@ -487,9 +660,7 @@ class DataViewer(QMainWindow):
         selection.show()
         if selection.exec():
             freq = selection.get_selection()
-            b, a = signal.butter(6, (float(freq) / (self.bdf.freq / 2)), "low")
-            self.data = signal.filtfilt(b, a, self.data)
-            self._update_plot()
+            self._add_filter("low", float(freq), order=6)
 
     def _on_decimate_file_clicked(self):
         """Get user selected decimate factor and call bdf.decimate()"""
@@ -585,6 +756,7 @@ class DataViewer(QMainWindow):
 
             self.bdf.rereference(chans)
             self.data = self.bdf.data
+            self.lod = None  # data changed in place
             self._set_plot()
             self._update_plot()
 
@@ -617,10 +789,17 @@ class DataViewer(QMainWindow):
             self._update_plot()
 
     def _on_write_file_clicked(self):
-        """Write data to *.bdf file."""
+        """Write data to *.bdf file (display filters applied to all data)."""
 
         file = QFileDialog.getSaveFileName(self, "Save file", os.getcwd(), "BDF(*.bdf)")
-        self.bdf.write(fname=file[0])
+
+        data = self.bdf.data
+        try:
+            for ftype, freq, order in self.display_filters:
+                self.bdf.filter(ftype, freq, order, n_threads=0)
+            self.bdf.write(fname=file[0])
+        finally:
+            self.bdf.data = data
 
     def _on_merge_file_clicked(self):
         """Merge 2 (or more) *.bdf files."""
@@ -640,8 +819,6 @@ class DataViewer(QMainWindow):
                 for filename in filenames:
                     self.fname.append(filename)
             self.read_bdf_file()
-            self._set_plot()
-            self._update_plot()
 
     def _on_y_demean(self):
         """Set y-scale demean on/off."""
@@ -755,10 +932,6 @@ class DataViewer(QMainWindow):
             self.fname = fname  # need full path for read_bdf_file()
             self.read_bdf_file()
             self.fname = os.path.split(self.fname)[1]  # only filename
-            self.channel_selection = []
-            self._set_selection_labels()
-            self._set_plot()
-            self._update_plot()
 
     def select_layout_file(self):
         """*.csv file selection."""
@@ -772,14 +945,21 @@ class DataViewer(QMainWindow):
     def _on_clear_file_clicked(self):
         """Clear current plot."""
 
+        self._cancel_loading(keep=False)
+
         # if x_scroll on need to turn off before clearing plot
         if self.scale["x_scroll"]:
             self.on_x_scroll_clicked()
 
         # reset
         self.fname = None
+        self.bdf = None
         self.data = None
         self.time = None
+        self.lod = None
+        self.display_filters = []
+        self._clear_filter_cache()
+        self.prefetch.clear()
         self.n_channels = None
         self.channel_selected = None
         self.labels_org = None
@@ -868,6 +1048,7 @@ class DataViewer(QMainWindow):
         else:
             self.gui.x_scroll.setText("X Scroll Auto (on)")
             self.timer.stop()
+            self.prefetch.clear()
 
     def _on_x_scroll_pos_slider(self):
         """Change x-scale position"""
@@ -1013,17 +1194,29 @@ class DataViewer(QMainWindow):
             self.channel_selection = list(range(self.n_channels))
         self._calculate_y_offset()
 
+        if self.batched_plot:
+            pen = pg.mkPen(self.theme[1], width=self.line_width)
+            self.batch_item = pg.PlotCurveItem(pen=pen, name="Data")
+            self.batch_item.setClickable(True, width=5)
+            self.batch_item.sigClicked.connect(self._on_batch_clicked)
+            self.plot.addItem(self.batch_item)
+
+            pen = pg.mkPen(self.theme[1], width=self.line_width * 2)
+            self.batch_selected_item = pg.PlotCurveItem(pen=pen, name="Selected")
+            self.plot.addItem(self.batch_selected_item)
+
         colour_idx = np.linspace(0, self.colours.N, self.n_channels)
         for channel in self.channel_selection:
             colour = self.colours(int(colour_idx[channel]), bytes=True)
 
-            channel_item = pg.PlotCurveItem(
-                pen=pg.mkPen(colour, width=self.line_width), name="Data"
-            )
-            channel_item.setClickable(self)
-            channel_item.sigClicked.connect(self._on_channel_selected)
-            self.channel_items.append(channel_item)
-            self.plot.addItem(channel_item)
+            if not self.batched_plot:
+                channel_item = pg.PlotCurveItem(
+                    pen=pg.mkPen(colour, width=self.line_width), name="Data"
+                )
+                channel_item.setClickable(self)
+                channel_item.sigClicked.connect(self._on_channel_selected)
+                self.channel_items.append(channel_item)
+                self.plot.addItem(channel_item)
 
             self.labels_selected.append(self.labels_org[channel])
             label_item = pg.TextItem(
@@ -1046,15 +1239,30 @@ class DataViewer(QMainWindow):
     def _update_plot(self):
         """Update plot."""
 
-        data, time = self._crop_x_dimension()
+        if self.lod is None or self.lod.data is not self.data:
+            self.lod = MinMaxPyramid(self.data)
+            self._clear_filter_cache()
 
-        if self.scale["y_demean"]:
-            data = self.demean_data(data)
+        settings = self._window_settings()
+        xmin, xmax = self.scale["xmin"], self.scale["xmax"]
+        if self.scale["x_scroll"]:  # windows ahead are prepared in background
+            data, time = self.prefetch.get(
+                partial(self._prepare_window, settings),
+                xmin,
+                xmax,
+                self.scale["x_scroll_speed"],
+                np.shape(self.data)[1],
+                key=settings,
+            )
+        else:
+            data, time = self._prepare_window(settings, xmin, xmax)
 
         self._set_axes(self.scale["type"])
 
         # channel data
-        if self.scale["type"][0] == "vertical":
+        if self.batched_plot:
+            self._update_batch_plot(data, time)
+        elif self.scale["type"][0] == "vertical":
             for idx, channel in enumerate(self.channel_items):
                 channel.setData(time, data[idx, :])
                 channel.setPos(0, self.scale["yoffset"][idx])
@@ -1076,6 +1284,71 @@ class DataViewer(QMainWindow):
         if self.plot_topography_on:
             self.plot_topography()
 
+    def _update_batch_plot(self, data, time):
+        """
+        Draw all channels as one path (offsets already added by
+        _prepare_window): the connect array breaks the path between
+        channels.
+        """
+
+        n_chans, n_pnts = np.shape(data)
+        self.plot_data, self.plot_time = data, time
+
+        connect = np.ones((n_chans, n_pnts), dtype=bool)
+        connect[:, -1] = False
+        self.batch_item.setData(
+            np.tile(time, n_chans), np.ravel(data), connect=connect.reshape(-1)
+        )
+
+        if self.channel_selected in self.labels_selected:
+            idx = self.labels_selected.index(self.channel_selected)
+            self.batch_selected_item.setData(time, data[idx])
+        else:
+            self.batch_selected_item.setData([], [])
+
+    def _on_batch_clicked(self, item, event):
+        """
+        Select the channel nearest to the clicked point (batched plot): the
+        nearest y-offset (vertical) or data value (butterfly).
+        """
+
+        if self.plot_data is None or len(self.plot_time) == 0:
+            return
+
+        point = self.plot.plotItem.vb.mapSceneToView(event.scenePos())
+        if self.scale["type"][0] == "vertical":
+            n_chans = np.shape(self.plot_data)[0]
+            distance = self.scale["yoffset"][:n_chans] - point.y()
+        else:
+            sample = np.abs(self.plot_time - point.x()).argmin()
+            distance = self.plot_data[:, sample] - point.y()
+        idx = int(np.abs(distance).argmin())
+
+        label = self.labels_selected[idx]
+        self.channel_selected = None if self.channel_selected == label else label
+
+        font_size = self.myfont.pointSize()
+        for label_idx, label_item in enumerate(self.label_items):
+            selected = label_idx == idx and self.channel_selected is not None
+            self.myfont.setPointSize(font_size * 2 if selected else font_size)
+            label_item.setFont(self.myfont)
+        self.myfont.setPointSize(font_size)
+
+        if self.channel_selected is None:
+            self.batch_selected_item.setData([], [])
+        else:
+            self.batch_selected_item.setData(self.plot_time, self.plot_data[idx])
+        if self.cursor_on:
+            self._simulate_mouse_movment()
+
+    def _on_batched_plot_clicked(self):
+        """Toggle drawing all channels as one curve item."""
+
+        self.batched_plot = not self.batched_plot
+        self.channel_selected = None
+        self._set_plot()
+        self._update_plot()
+
     def _plot_events(self):
         """Show events as vertical line with corresponding event code."""
 
@@ -1106,13 +1379,122 @@ class DataViewer(QMainWindow):
             event.setAngle(90)
             self.plot.addItem(event, ignoreBounds=False)
 
-    def _crop_x_dimension(self):
-        """Crop data along the x-dimnsion for plotting."""
+    def _window_settings(self):
+        """
+        Settings that determine the prepared plot window, captured on the
+        gui thread (prefetched windows are discarded when they change).
+        :return: tuple (lod, chans, n_bins, demean, offsets, display filters,
+            sampling frequency, data version)
+        """
 
-        data = self.data[
-            self.channel_selection, self.scale["xmin"] : self.scale["xmax"]
-        ]
-        time = self.time[self.scale["xmin"] : self.scale["xmax"]]
+        offsets = None
+        if self.batched_plot and self.scale["type"][0] == "vertical":
+            n_chans = len(self.channel_selection)
+            offsets = tuple(self.scale["yoffset"][:n_chans])
+
+        return (
+            self.lod,
+            tuple(self.channel_selection),
+            max(self.plot.width(), 1),
+            self.scale["y_demean"],
+            offsets,
+            tuple(self.display_filters),
+            self.bdf.freq,
+            self.data_version,
+        )
+
+    def _prepare_window(self, settings, xmin, xmax):
+        """
+        Crop, demean and offset the data of one plot window. Does not
+        access qt objects, so it can run in the prefetch thread.
+        :param settings: tuple (see _window_settings)
+        :param xmin: int
+        :param xmax: int
+        :return: data, time
+        """
+
+        lod, chans, n_bins, demean, offsets, display_filters, fs, version = settings
+        if display_filters:
+            data, time = self._filter_window(
+                lod, chans, n_bins, xmin, xmax, display_filters, fs, version
+            )
+        else:
+            data, time = self._crop_x_dimension(lod, chans, n_bins, xmin, xmax)
+
+        if demean:
+            data = self.demean_data(data)
+        if offsets is not None:
+            data = data + np.array(offsets)[:, None]
+
+        return data, time
+
+    def _filter_window(
+        self, lod, chans, n_bins, xmin, xmax, display_filters, fs, version
+    ):
+        """
+        Apply display filters to the window xmin to xmax only, padded on
+        both sides by the samples after which the impulse responses have
+        decayed (filters.pad_length), so the window matches filtering the
+        whole data, then crop/reduce as _crop_x_dimension. The plotted
+        windows are cached (_FILTER_CACHE windows, cleared when the data
+        changes).
+        :param lod: MinMaxPyramid (of the unfiltered data)
+        :param chans: tuple
+        :param n_bins: int
+        :param xmin: int
+        :param xmax: int
+        :param display_filters: tuple of (ftype, freq, order)
+        :param fs: int (sampling frequency of the data)
+        :param version: int (data version, see _clear_filter_cache)
+        :return: data, time
+        """
+
+        key = (version, chans, n_bins, xmin, xmax, display_filters, fs)
+        with self.filter_lock:
+            if key in self.filter_cache:
+                self.filter_cache.move_to_end(key)
+                return self.filter_cache[key]
+
+        pad = 0
+        for ftype, freq, order in display_filters:
+            pad += filters.pad_length(filters.design(ftype, freq, fs, order))
+        start, stop = max(xmin - pad, 0), min(xmax + pad, lod.n_pnts)
+
+        data = np.asarray(lod.data[list(chans), start:stop])
+        for ftype, freq, order in display_filters:
+            data = filters.filtfilt(data, ftype, freq, fs, order, n_threads=0)
+        data, idx = envelope(
+            data, list(range(len(chans))), xmin - start, xmax - start, n_bins
+        )
+        time = self.time[idx + start]
+
+        with self.filter_lock:
+            if version != self.data_version:  # data changed meanwhile
+                return data, time
+            self.filter_cache[key] = data, time
+            while len(self.filter_cache) > _FILTER_CACHE:
+                self.filter_cache.popitem(last=False)
+
+        return data, time
+
+    def _clear_filter_cache(self):
+        """
+        Discard the filtered plot windows (new data or file), so that no
+        copies of previous data are kept.
+        """
+
+        with self.filter_lock:
+            self.filter_cache.clear()
+            self.data_version += 1
+
+    def _crop_x_dimension(self, lod, chans, n_bins, xmin, xmax):
+        """
+        Crop data along the x-dimnsion for plotting. Long ranges are
+        reduced to the min/max envelope with ~2 points per pixel.
+        """
+
+        data, idx = lod.query(list(chans), xmin, xmax, n_bins)
+        time = self.time[idx]
 
         return data, time
 
@@ -1236,6 +1618,109 @@ class DataViewer(QMainWindow):
             self._update_plot()
 
 
+_FILTER_CACHE = 16  # display filtered windows kept
+
+
+class FileLoader(QThread):
+    """
+    Read a *.bdf file in a background thread (BDF.read_progressive),
+    emitting progress after each block of records. The BDF data arrays
+    are allocated up front and filled in place, so the file can be shown
+    while it is read. Reading stops early on requestInterruption().
+    """
+
+    progress = pyqtSignal(int, int)  # samples read, total samples
+
+    def __init__(self, fname, chans=None, n_records=10, parent=None):
+        """
+        :param fname: string
+        :param chans: list
+        :param n_records: int (records read per progress step)
+        :param parent: QObject
+        """
+
+        super(FileLoader, self).__init__(parent)
+        self.fname = fname
+        self.chans = chans
+        self.n_records = n_records
+        self.bdf = BDF()
+        self.n_shown = 0  # samples displayed (updated by the gui)
+        self.cancelled = False
+        self.error = None
+
+    def run(self):
+        try:
+            # serial decoding: parallel kernels also run on the gui thread
+            steps = self.bdf.read_progressive(
+                self.fname, chans=self.chans, n_records=self.n_records
+            )
+            for n_read, n_total in steps:
+                if self.isInterruptionRequested():
+                    self.cancelled = True
+                    steps.close()
+                    break
+                self.progress.emit(n_read, n_total)
+        except Exception as e:  # shown by the gui thread
+            self.error = e
+
+
+class WindowPrefetcher:
+    """
+    Prepare upcoming plot windows during auto-scroll in a background
+    thread, keeping up to n_windows ready buffers, so that the paint path
+    only swaps arrays.
+    """
+
+    def __init__(self, n_windows=4):
+        """
+        :param n_windows: int
+        """
+
+        self.n_windows = n_windows
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.ready = OrderedDict()  # (xmin, xmax): future
+        self.key = None
+
+    def get(self, prepare, xmin, xmax, step, n_pnts, key=None):
+        """
+        Return the window xmin to xmax (prefetched or prepared now) and
+        queue the next n_windows windows (advancing by step samples).
+        :param prepare: function (xmin, xmax) returning data, time
+        :param xmin: int
+        :param xmax: int
+        :param step: int
+        :param n_pnts: int (length of data)
+        :param key: settings used by prepare (change clears the buffers)
+        :return: data, time
+        """
+
+        if key != self.key:
+            self.clear()
+            self.key = key
+
+        future = self.ready.pop((xmin, xmax), None)
+        for window in [x for x in self.ready if x[0] < xmin]:  # passed
+            self.ready.pop(window).cancel()
+        result = prepare(xmin, xmax) if future is None else future.result()
+
+        for i in range(1, self.n_windows + 1):
+            window = (xmin + i * step, xmax + i * step)
+            if step <= 0 or window[1] >= n_pnts:
+                break
+            if window not in self.ready:
+                self.ready[window] = self.pool.submit(prepare, *window)
+
+        return result
+
+    def clear(self):
+        """Discard all prepared windows."""
+
+        for future in self.ready.values():
+            future.cancel()
+        self.ready.clear()
+        self.key = None
+
+
 def time_to_idx(t1, t2, time_array):
     """time_to_idx"""
     idx1 = np.abs(time_array - t1).argmin()
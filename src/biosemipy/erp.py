@@ -0,0 +1,142 @@
+"""
+Python module to average event-related potentials (ERPs) incrementally.
+Epochs (e.g., from BDF.epochs or bdf.read_epochs) are added per trigger
+value and only the running count, mean and sum of squared deviations
+(Welford/Chan update) are kept, so memory does not depend on the number
+of trials or files.
+"""
+
+import numpy as np
+
+
+class ERPAccumulator:
+    """
+    Running average and variance per trigger value (condition), e.g.
+    acc = ERPAccumulator(tmin=-0.1, freq=2048)
+    for fname in fnames:
+        epochs, values = bdf.read_epochs(fname, [1, 2], -0.1, 0.5)
+        acc.add(epochs, values)
+    Topo().plot(acc.topography(1, 0.1, 0.2))
+    Accumulators of parallel workers are combined with merge.
+    """
+
+    def __init__(self, tmin=0.0, freq=1):
+        """
+        :param tmin: float (time of first epoch sample, seconds)
+        :param freq: int (sampling frequency)
+        """
+
+        self.tmin = tmin
+        self.freq = freq
+        self.count = {}  # trials per trigger value
+        self.mean = {}  # channels by timepoints (float64)
+        self.m2 = {}  # sum of squared deviations from mean
+
+    @property
+    def values(self):
+        return sorted(self.count)
+
+    def add(self, epochs, values):
+        """
+        Add epochs (epochs by channels by timepoints) with their trigger
+        values.
+        :param epochs: numpy array
+        :param values: numpy vector/int (trigger value of each/all epochs)
+        """
+
+        values = np.broadcast_to(values, len(epochs))
+        for value in np.unique(values):
+            batch = np.asarray(epochs[values == value], dtype=np.float64)
+            mean = batch.mean(axis=0)
+            m2 = ((batch - mean) ** 2).sum(axis=0)
+            self._update(value.item(), len(batch), mean, m2)
+
+    def merge(self, other):
+        """
+        Combine with the accumulated epochs of another ERPAccumulator.
+        :param other: ERPAccumulator
+        """
+
+        assert self.freq == other.freq, "Sampling frequencies do not match!"
+        assert self.tmin == other.tmin, "Epoch start times do not match!"
+        for value in other.count:
+            self._update(value, other.count[value], other.mean[value], other.m2[value])
+
+    def average(self, value):
+        """
+        Average ERP (channels by timepoints).
+        :param value: int (trigger value)
+        :return: numpy matrix
+        """
+
+        return self.mean[value]
+
+    def variance(self, value, ddof=1):
+        """
+        Variance across trials (channels by timepoints).
+        :param value: int (trigger value)
+        :param ddof: int
+        :return: numpy matrix
+        """
+
+        return self.m2[value] / max(self.count[value] - ddof, 1)
+
+    def sem(self, value):
+        """
+        Standard error of the mean (channels by timepoints).
+        :param value: int (trigger value)
+        :return: numpy matrix
+        """
+
+        return np.sqrt(self.variance(value) / self.count[value])
+
+    def time(self):
+        """
+        Time of each epoch sample (seconds).
+        :return: numpy vector
+        """
+
+        n_samps = next(iter(self.mean.values())).shape[1] if self.mean else 0
+        return self.tmin + np.arange(n_samps) / self.freq
+
+    def topography(self, value, tmin, tmax):
+        """
+        Average amplitude per channel from tmin to tmax (seconds, tmax
+        exclusive), e.g. as data for Topo.plot.
+        :param value: int (trigger value)
+        :param tmin: float
+        :param tmax: float
+        :return: numpy vector
+        """
+
+        start = int(round((tmin - self.tmin) * self.freq))
+        stop = int(round((tmax - self.tmin) * self.freq))
+        assert 0 <= start < stop <= self.mean[value].shape[1], "Outside of epoch!"
+
+        return self.mean[value][:, start:stop].mean(axis=1)
+
+    def _update(self, value, n, mean, m2):
+        """
+        Combine the statistics of value with n trials of mean and m2
+        (Chan et al. parallel variance update).
+        :param value: int (trigger value)
+        :param n: int
+        :param mean: numpy matrix
+        :param m2: numpy matrix
+        """
+
+        if n == 0:
+            return
+        if value not in self.count:
+            self.count[value] = n
+            self.mean[value] = np.array(mean, dtype=np.float64)
+            self.m2[value] = np.array(m2, dtype=np.float64)
+            return
+
+        assert self.mean[value].shape == np.shape(mean), "Epoch shapes do not match!"
+        n_a = self.count[value]
+        n_ab = n_a + n
+        delta = mean - self.mean[value]
+        self.mean[value] += delta * (n / n_ab)
+        self.m2[value] += m2 + delta**2 * (n_a * n / n_ab)
+        self.count[value] = n_ab
@@ -0,0 +1,208 @@
+"""
+Python module to filter BioSemi EEG data (high-pass, low-pass, band-pass
+and notch) using second-order sections, either causally in chunks with
+carried filter state, or zero-phase in memory or over chunks with
+padding taken from the neighbouring chunks. Output keeps the dtype of the
+input (e.g., float32); filtering is done in blocks of channels, so float64
+temporaries are limited to one block per thread.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import signal
+
+
+def design(ftype, freq, fs, order=2):
+    """
+    Design butterworth (high, low, band) or notch filter as second-order
+    sections.
+    :param ftype: string "high", "low", "band" or "notch"
+    :param freq: float (cutoff/notch frequency) or list (band edges)
+    :param fs: float (sampling frequency)
+    :param order: int (notch: quality factor)
+    :return: numpy matrix (sos)
+    """
+
+    assert ftype in ["high", "low", "band", "notch"], "ftype not recognized"
+
+    if ftype == "notch":
+        b, a = signal.iirnotch(freq, order, fs=fs)
+        return signal.tf2sos(b, a)
+    if ftype == "band":
+        ftype = "bandpass"
+
+    return signal.butter(order, freq, ftype, fs=fs, output="sos")
+
+
+def pad_length(sos, tol=1e-4):
+    """
+    Number of samples after which the impulse response of the filter has
+    decayed below tol (relative), based on its slowest decaying pole.
+    :param sos: numpy matrix
+    :param tol: float
+    :return: int
+    """
+
+    _, poles, _ = signal.sos2zpk(sos)
+    radius = np.max(np.abs(poles)) if len(poles) else 0
+    if radius <= 0:
+        return 1
+
+    return int(np.ceil(np.log(tol) / np.log(radius)))
+
+
+class Filter:
+    """
+    Causal filter applied chunk by chunk, carrying the filter state (zi)
+    between chunks, e.g. over BDF.iter_chunks:
+    filt = Filter("high", 0.1, bdf.hdr["freq"][0])
+    for data, trig, status, offset in bdf.iter_chunks(60, dtype="float32"):
+        data = filt.process(data)
+    """
+
+    def __init__(self, ftype, freq, fs, order=2, n_threads=1):
+        """
+        :param ftype: string "high", "low", "band" or "notch"
+        :param freq: float or list
+        :param fs: float
+        :param order: int
+        :param n_threads: int (0 uses all available cores)
+        """
+
+        self.sos = design(ftype, freq, fs, order)
+        self.n_threads = n_threads
+        self.zi = None
+
+    def process(self, data):
+        """
+        Filter the next chunk (channels by timepoints).
+        :param data: numpy matrix
+        :return: numpy matrix
+        """
+
+        data = _as_float(data)
+
+        if self.zi is None:  # steady state for first sample of each channel
+            zi = signal.sosfilt_zi(self.sos)
+            self.zi = zi[:, None, :] * data[None, :, 0, None].astype(np.float64)
+
+        def func(rows):
+            out, self.zi[:, rows] = signal.sosfilt(
+                self.sos, data[rows], axis=1, zi=self.zi[:, rows]
+            )
+            return out
+
+        return _apply_rows(func, data, self.n_threads)
+
+    def reset(self):
+        """Reset filter state (e.g., before a new recording)."""
+
+        self.zi = None
+
+
+def filtfilt(data, ftype, freq, fs, order=2, n_threads=1):
+    """
+    Zero-phase filter data (channels by timepoints).
+    :param data: numpy matrix
+    :param ftype: string "high", "low", "band" or "notch"
+    :param freq: float or list
+    :param fs: float
+    :param order: int
+    :param n_threads: int (0 uses all available cores)
+    :return: numpy matrix
+    """
+
+    data = _as_float(data)
+    sos = design(ftype, freq, fs, order)
+
+    def func(rows):
+        return signal.sosfiltfilt(sos, data[rows], axis=1)
+
+    return _apply_rows(func, data, n_threads)
+
+
+def filtfilt_chunks(chunks, ftype, freq, fs, order=2, n_threads=1):
+    """
+    Zero-phase filter a sequence of chunks (channels by timepoints). Each
+    chunk is filtered together with pad_length samples of the previous and
+    next chunk, which are then discarded, so the output matches filtering
+    the concatenated data up to tolerance (chunks should be longer than
+    the pad length). Output is delayed by one chunk.
+    :param chunks: iterable of numpy matrices
+    :param ftype: string "high", "low", "band" or "notch"
+    :param freq: float or list
+    :param fs: float
+    :param order: int
+    :param n_threads: int (0 uses all available cores)
+    :return: generator of numpy matrices
+    """
+
+    sos = design(ftype, freq, fs, order)
+    padlen = pad_length(sos)
+
+    def segment(prev, cur, nxt):
+        parts = [x for x in [prev, cur, nxt] if x is not None]
+        start = 0 if prev is None else prev.shape[1]
+        data = np.concatenate(parts, axis=1) if len(parts) > 1 else cur
+
+        def func(rows):
+            return signal.sosfiltfilt(sos, data[rows], axis=1)
+
+        out = _apply_rows(func, data, n_threads)
+        return out[:, start : start + cur.shape[1]]
+
+    prev, cur = None, None
+    for nxt in chunks:
+        nxt = _as_float(nxt)
+        if cur is not None:
+            yield segment(prev, cur, nxt[:, :padlen])
+            prev = cur if prev is None else np.concatenate([prev, cur], axis=1)
+            prev = prev[:, -padlen:]
+        cur = nxt
+    if cur is not None:
+        yield segment(prev, cur, None)
+
+
+def _as_float(data):
+    """Return data as floating point numpy matrix (raw counts as float64)."""
+
+    data = np.asarray(data)
+    if not np.issubdtype(data.dtype, np.floating):
+        data = data.astype(np.float64)
+
+    return data
+
+
+def _apply_rows(func, data, n_threads=1):
+    """
+    Apply func to blocks of _BLOCK_CHANS rows (channels), in a thread pool
+    if n_threads > 1 (scipy filter functions release the GIL), writing the
+    results into one output matrix with the dtype of data.
+    :param func: function taking a slice of rows and returning the result
+    :param data: numpy matrix
+    :param n_threads: int (0 uses all available cores)
+    :return: numpy matrix
+    """
+
+    n_chans = np.shape(data)[0]
+    out = np.empty_like(data)
+
+    def block(row):
+        rows = slice(row, row + _BLOCK_CHANS)
+        out[rows] = func(rows)
+
+    if n_threads <= 0:
+        n_threads = os.cpu_count()
+    if n_threads == 1:
+        for row in range(0, n_chans, _BLOCK_CHANS):
+            block(row)
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            list(pool.map(block, range(0, n_chans, _BLOCK_CHANS)))
+
+    return out
+
+
+_BLOCK_CHANS = 8  # channels filtered per block
@@ -0,0 +1,261 @@
+"""
+Python module for multi-resolution min/max envelopes (level-of-detail
+pyramid) of BioSemi EEG data. The dataviewer queries the envelope of the
+visible time range so that at most ~2 points per screen pixel and channel
+are drawn, independent of the zoom level.
+"""
+
+import os
+
+import numpy as np
+from numba import jit, prange
+
+from biosemipy.bdf import _file_key
+
+
+class MinMaxPyramid:
+    """
+    Min/max envelopes of data (channels by timepoints) over bins of
+    _BASE_BIN * 2**level samples, built once per dataset, e.g.
+    lod = MinMaxPyramid(bdf.data, fname="filename.bdf")
+    data, idx = lod.query([0, 1, 2], 0, np.shape(bdf.data)[1], n_bins=1000)
+    With fname, the envelopes are stored in a sidecar file (fname +
+    ".lod.npz") that is reused while the file and channels match.
+    """
+
+    def __init__(self, data, fname=None, chans=None):
+        """
+        :param data: numpy matrix
+        :param fname: string (source bdf file of data, enables disk cache)
+        :param chans: list (channels of the file in data)
+        """
+
+        self.data = data
+        self.n_pnts = np.shape(data)[1]
+        self.levels = None
+
+        key, fname_cache = None, None
+        if fname is not None and os.path.isfile(fname):
+            key = f"{_file_key(fname)}:{chans}:{np.shape(data)}"
+            fname_cache = fname + _LOD_EXT
+            self.levels = _load(fname_cache, key)
+
+        if self.levels is None:
+            self.levels = self._build()
+            if fname_cache is not None:
+                _store(fname_cache, key, self.levels)
+
+    def query(self, chans, start, stop, n_bins):
+        """
+        Data of chans from sample start to stop (exclusive) with at most
+        2 * n_bins points per channel: the raw samples if there are few
+        enough, otherwise the interleaved min/max of bins of at least
+        (stop - start) / n_bins samples (from the finest pyramid level
+        with large enough bins, or computed from the raw samples for
+        bins smaller than _BASE_BIN).
+        :param chans: list
+        :param start: int
+        :param stop: int
+        :param n_bins: int (e.g., plot width in pixels)
+        :return: data (channels by points), sample index of each point
+        """
+
+        n_pnts = stop - start
+        bin_size = -(-n_pnts // n_bins)
+        if n_pnts <= 2 * n_bins or bin_size < _BASE_BIN:
+            return envelope(self.data, chans, start, stop, n_bins)
+
+        level = int(np.ceil(np.log2(bin_size / _BASE_BIN)))
+        level = min(level, len(self.levels) - 1)
+        bin_size = _BASE_BIN << level
+        bin_start, bin_stop = start // bin_size, -(-stop // bin_size)
+        env = self.levels[level][chans, bin_start:bin_stop]
+
+        return _interleave(env, bin_start * bin_size, bin_size, self.n_pnts)
+
+    def update(self, start, stop):
+        """
+        Recompute the envelopes of the bins covering samples start to stop,
+        e.g. after data was filled in place while reading a file.
+        :param start: int
+        :param stop: int
+        """
+
+        data = np.asarray(self.data)
+        chans = np.arange(data.shape[0])
+        bin_start, bin_stop = start // _BASE_BIN, -(-stop // _BASE_BIN)
+        first = bin_start * _BASE_BIN
+        last = min(bin_stop * _BASE_BIN, self.n_pnts)
+        env = _minmax(data, chans, first, last, _BASE_BIN)
+        self.levels[0][:, bin_start:bin_stop] = env
+
+        for level in range(1, len(self.levels)):
+            bin_start, bin_stop = bin_start // 2, -(-bin_stop // 2)
+            prev = self.levels[level - 1][:, 2 * bin_start : 2 * bin_stop]
+            self.levels[level][:, bin_start:bin_stop] = _merge_bins(prev)
+
+    def _build(self):
+        """
+        Compute the envelope levels, each halving the number of bins of
+        the previous one, until a level has at most _MIN_BINS bins.
+        :return: list of numpy arrays (channels by bins by min/max)
+        """
+
+        data = np.asarray(self.data)
+        chans = np.arange(data.shape[0])
+        levels = [_minmax(data, chans, 0, self.n_pnts, _BASE_BIN).astype(np.float32)]
+        while levels[-1].shape[1] > _MIN_BINS:
+            levels.append(_merge_bins(levels[-1]))
+
+        return levels
+
+
+def envelope(data, chans, start, stop, n_bins):
+    """
+    As MinMaxPyramid.query, but computed from the raw samples without a
+    pyramid (e.g., for a filtered copy of the visible range). Uses a serial
+    kernel, so it can run in a background thread while the GUI thread runs
+    the parallel ones.
+    :param data: numpy matrix (channels by timepoints)
+    :param chans: list
+    :param start: int
+    :param stop: int
+    :param n_bins: int
+    :return: data (channels by points), sample index of each point
+    """
+
+    n_pnts = stop - start
+    if n_pnts <= 2 * n_bins:
+        return data[chans, start:stop], np.arange(start, stop)
+
+    bin_size = -(-n_pnts // n_bins)
+    chans = np.asarray(chans, dtype=np.int64)
+    env = _minmax_serial(np.asarray(data), chans, start, stop, bin_size)
+
+    return _interleave(env, start, bin_size, np.shape(data)[1])
+
+
+def _interleave(env, first, bin_size, n_pnts):
+    """
+    Interleave the min/max of each bin and place them at the start and
+    middle of the bin.
+    :param env: numpy array (channels by bins by min/max)
+    :param first: int (first sample of the first bin)
+    :param bin_size: int
+    :param n_pnts: int (number of samples of the data)
+    :return: data (channels by points), sample index of each point
+    """
+
+    n_env = env.shape[1]
+    idx = first + np.arange(n_env)[:, None] * bin_size + [0, bin_size // 2]
+    idx = np.minimum(idx.reshape(-1), n_pnts - 1)
+
+    return env.reshape(len(env), 2 * n_env), idx
+
+
+def _load(fname_cache, key):
+    """
+    Load envelope levels from the sidecar file if its key matches.
+    :param fname_cache: string
+    :param key: string
+    :return: list of numpy arrays or None
+    """
+
+    if not os.path.isfile(fname_cache):
+        return None
+    try:
+        with np.load(fname_cache) as npz:
+            if npz["key"].item() != key:
+                return None
+            return [npz[f"level{i}"] for i in range(int(npz["n_levels"]))]
+    except (OSError, ValueError, KeyError):  # invalid cache, rebuild
+        return None
+
+
+def _store(fname_cache, key, levels):
+    """
+    Store envelope levels in the sidecar file.
+    :param fname_cache: string
+    :param key: string
+    :param levels: list of numpy arrays
+    """
+
+    try:
+        fname_tmp = f"{fname_cache}.{os.getpid()}.tmp"
+        with open(fname_tmp, "wb") as f:
+            arrays = {f"level{i}": x for i, x in enumerate(levels)}
+            np.savez(f, key=np.array(key), n_levels=len(levels), **arrays)
+        os.replace(fname_tmp, fname_cache)
+    except OSError:  # e.g., read only directory
+        pass
+
+
+_LOD_EXT = ".lod.npz"  # sidecar cache file extension
+_BASE_BIN = 64  # samples per bin of the finest level
+_MIN_BINS = 512  # bins of the coarsest level
+
+
+@jit(nopython=True, parallel=True)
+def _minmax(data, chans, start, stop, bin_size):
+    """
+    Min/max of chans over bins of bin_size samples from start to stop (last
+    bin may be partial), without copying the selected data.
+    :param data: numpy matrix (channels by timepoints)
+    :param chans: numpy vector
+    :param start: int
+    :param stop: int
+    :param bin_size: int
+    :return: numpy array (chans by bins by min/max)
+    """
+
+    n_chans = len(chans)
+    n_bins = -(-(stop - start) // bin_size)
+    env = np.empty((n_chans, n_bins, 2), dtype=data.dtype)
+
+    for c in prange(n_chans):
+        chan = chans[c]
+        for b in range(n_bins):
+            first = start + b * bin_size
+            last = min(first + bin_size, stop)
+            lo = data[chan, first]
+            hi = data[chan, first]
+            for i in range(first + 1, last):
+                val = data[chan, i]
+                if val < lo:
+                    lo = val
+                elif val > hi:
+                    hi = val
+            env[c, b, 0] = lo
+            env[c, b, 1] = hi
+
+    return env
+
+
+# serial twin for background threads: numba's default (workqueue) threading
+# layer aborts if two threads launch parallel kernels at the same time
+_minmax_serial = jit(nopython=True, nogil=True)(_minmax.py_func)
+
+
+@jit(nopython=True, parallel=True)
+def _merge_bins(env):
+    """
+    Combine pairs of bins of an envelope level into the next level.
+    :param env: numpy array (channels by bins by min/max)
+    :return: numpy array (channels by bins / 2 by min/max)
+    """
+
+    n_chans, n_bins, _ = env.shape
+    n_out = -(-n_bins // 2)
+    out = np.empty((n_chans, n_out, 2), dtype=env.dtype)
+
+    for chan in prange(n_chans):
+        for b in range(n_out):
+            lo = env[chan, 2 * b, 0]
+            hi = env[chan, 2 * b, 1]
+            if 2 * b + 1 < n_bins:
+                lo = min(lo, env[chan, 2 * b + 1, 0])
+                hi = max(hi, env[chan, 2 * b + 1, 1])
+            out[chan, b, 0] = lo
+            out[chan, b, 1] = hi
+
+    return out
@@ -0,0 +1,280 @@
+"""
+Python module to resample BioSemi EEG data by any rational factor using
+polyphase FIR filtering (as scipy.signal.resample_poly), split into
+several stages for large integer factors, either in memory or in chunks
+with the filter history carried between chunks.
+"""
+
+from fractions import Fraction
+
+import numpy as np
+from numba import jit
+from scipy.signal import firwin
+
+
+def ratio(freq_old, freq_new):
+    """
+    Reduced up/down factors to resample from freq_old to freq_new.
+    :param freq_old: int/float
+    :param freq_new: int/float
+    :return: up, down
+    """
+
+    factor = Fraction(freq_new).limit_denominator() / Fraction(freq_old)
+    factor = factor.limit_denominator()
+
+    return factor.numerator, factor.denominator
+
+
+def stages(up, down, max_factor=10):
+    """
+    Split resampling by up/down into stages. Only integer factors (up or
+    down is 1) are split: their prime factors are combined into stages
+    with factors of at most max_factor (larger primes form their own
+    stage). Rational factors are resampled in a single stage, since any
+    split would run intermediate stages above both rates.
+    :param up: int
+    :param down: int
+    :param max_factor: int
+    :return: list of (up, down)
+    """
+
+    if min(up, down) > 1:
+        return [(up, down)]
+
+    factors = []
+    n, p = max(up, down), 2
+    while n > 1:
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+        p += 1
+
+    groups = []
+    for p in sorted(factors, reverse=True):
+        for i, group in enumerate(groups):
+            if group * p <= max_factor:
+                groups[i] *= p
+                break
+        else:
+            groups.append(p)
+    if not groups:
+        groups = [1]
+
+    if down >= up:
+        return [(1, x) for x in groups]
+
+    return [(x, 1) for x in groups]
+
+
+class Resampler:
+    """
+    Resample chunks (channels by timepoints) by up/down, carrying the
+    filter history between chunks, e.g.
+    resampler = Resampler(*ratio(16384, 256))
+    for data, trig, status, offset in bdf.iter_chunks(60, dtype="float32"):
+        out = resampler.process(data)
+    out = resampler.flush()
+    """
+
+    def __init__(self, up, down, max_factor=10):
+        """
+        :param up: int
+        :param down: int
+        :param max_factor: int (maximum factor per stage)
+        """
+
+        self.up, self.down = up, down
+        self.stages = []
+        rate = Fraction(1)  # stage output rate relative to input rate
+        for stage_up, stage_down in stages(up, down, max_factor):
+            rate *= Fraction(stage_up, stage_down)
+            rel = float(Fraction(up, down) / rate)
+            self.stages.append(_Stage(stage_up, stage_down, rel))
+
+    def process(self, data):
+        """
+        Resample the next chunk. The output lags the input by the filter
+        length; remaining samples are returned by flush.
+        :param data: numpy matrix
+        :return: numpy matrix
+        """
+
+        for stage in self.stages:
+            data = stage.process(data)
+
+        return data
+
+    def flush(self):
+        """
+        Return the remaining output samples at the end of the data
+        (ceil(n * up / down) samples in total).
+        :return: numpy matrix
+        """
+
+        data = None
+        for stage in self.stages:
+            if data is None:
+                data = stage.flush()
+            else:
+                data = np.concatenate([stage.process(data), stage.flush()], axis=1)
+
+        return data
+
+
+def resample(data, up, down, max_factor=10):
+    """
+    Resample data (channels by timepoints) by up/down.
+    :param data: numpy matrix
+    :param up: int
+    :param down: int
+    :param max_factor: int (maximum factor per stage)
+    :return: numpy matrix (ceil(n * up / down) timepoints)
+    """
+
+    resampler = Resampler(up, down, max_factor)
+    out = resampler.process(data)
+
+    return np.concatenate([out, resampler.flush()], axis=1)
+
+
+def resample_triggers(idx, val, up, down, n_pnts):
+    """
+    Map trigger onsets to the resampled time base. Onsets that would fall
+    on the same (or adjacent) sample are moved forward so that every
+    trigger remains a separate onset in the raw trigger vector.
+    :param idx: numpy vector (trigger onsets)
+    :param val: numpy vector (trigger values)
+    :param up: int
+    :param down: int
+    :param n_pnts: int (length of resampled data)
+    :return: idx, raw (trigger vector)
+    """
+
+    idx = np.round(np.asarray(idx) * up / down).astype(int)
+    for i in range(1, len(idx)):  # keep a zero sample between onsets
+        idx[i] = max(idx[i], idx[i - 1] + 2)
+
+    keep = idx < n_pnts
+    idx = idx[keep]
+    raw = np.zeros(n_pnts, dtype=np.int16)
+    raw[idx] = np.asarray(val)[keep]
+
+    return idx, raw
+
+
+class _Stage:
+    """Single polyphase FIR resampling stage with carried input history."""
+
+    def __init__(self, up, down, rel=1.0):
+        """
+        :param up: int
+        :param down: int
+        :param rel: float (final output rate / stage output rate)
+        """
+
+        # anti-aliasing filter as scipy.signal.resample_poly, shortened for
+        # intermediate decimation stages that only need to keep aliasing out
+        # of the final passband (wider transition band)
+        max_rate = max(up, down)
+        scale = 1.0
+        if down > up and rel < 1:
+            scale = min(1.0, _WIDTH / (2 * (1 - _PASS * rel)))
+        half_len = int(np.ceil(10 * max_rate * scale)) if max_rate > 1 else 0
+        self.h = np.ones(1)
+        if max_rate > 1:
+            self.h = firwin(2 * half_len + 1, 1 / max_rate, window=("kaiser", 5.0))
+            self.h *= up
+        self.up, self.down = up, down
+        self.delay = half_len
+        self.x = None  # input history
+        self.i0 = 0  # input index of first sample in history
+        self.n_in = 0  # input samples received
+        self.m = 0  # next output sample
+
+    def process(self, data):
+        """
+        Append data and return all output samples that can be computed.
+        :param data: numpy matrix
+        :return: numpy matrix
+        """
+
+        data = np.asarray(data)
+        if not np.issubdtype(data.dtype, np.floating):
+            data = data.astype(np.float64)
+        self.x = data if self.x is None else np.concatenate([self.x, data], axis=1)
+        self.n_in += data.shape[1]
+
+        m_stop = (self.n_in * self.up - 1 - self.delay) // self.down + 1
+        m_stop = max(m_stop, self.m)
+
+        return self._output(m_stop)
+
+    def flush(self):
+        """
+        Return the remaining output samples (input after the end is zero).
+        :return: numpy matrix
+        """
+
+        m_stop = -(-self.n_in * self.up // self.down)
+
+        return self._output(m_stop)
+
+    def _output(self, m_stop):
+        """
+        Compute output samples self.m to m_stop and drop input history that
+        is no longer required.
+        :param m_stop: int
+        :return: numpy matrix
+        """
+
+        out = _polyphase(
+            self.x, self.i0, self.h, self.up, self.down, self.delay, self.m, m_stop
+        )
+        self.m = m_stop
+
+        i_next = -(-(m_stop * self.down + self.delay - len(self.h) + 1) // self.up)
+        i_next = min(max(i_next, self.i0), self.n_in)
+        self.x = self.x[:, i_next - self.i0 :]
+        self.i0 = i_next
+
+        return out
+
+
+# passband edge and transition width of the resample_poly filter relative
+# to the output Nyquist frequency
+_PASS = 0.856
+_WIDTH = 0.3
+
+
+@jit(nopython=True)
+def _polyphase(x, i0, h, up, down, delay, m_start, m_stop):
+    """
+    Polyphase FIR resampling: output sample m is the sum over inputs i of
+    x[i] * h[m * down + delay - i * up] (only non-zero upsampled samples).
+    :param x: numpy matrix (input history, channels by timepoints)
+    :param i0: int (input index of first sample in x)
+    :param h: numpy vector (filter)
+    :param up: int
+    :param down: int
+    :param delay: int (filter delay in upsampled samples)
+    :param m_start: int
+    :param m_stop: int
+    :return: numpy matrix (channels by m_stop - m_start)
+    """
+
+    n_chans, n_pnts = x.shape
+    n_taps = len(h)
+    out = np.zeros((n_chans, max(m_stop - m_start, 0)), dtype=x.dtype)
+
+    for m in range(m_start, m_stop):
+        t = m * down + delay
+        i_start = max(-(-(t - n_taps + 1) // up), i0)
+        i_stop = min(t // up + 1, i0 + n_pnts)
+        for chan in range(n_chans):
+            acc = 0.0
+            for i in range(i_start, i_stop):
+                acc += x[chan, i - i0] * h[t - i * up]
+            out[chan, m - m_start] = acc
+
+    return out